@@ -0,0 +1,200 @@
+"""
+Periodic table shared by the TurbomoleScripts tools.
+
+All 118 elements are stored as contiguous NumPy arrays indexed by atomic
+number minus one. Atomic labels (case-insensitive, as written by
+Turbomole or in xyz files) are interned to these integer indices once
+per distinct label, after which the properties of a whole molecule are
+a single fancy-indexing operation:
+
+    idx = elements.intern(labels)
+    masses, numbers = elements.MASS[idx], elements.NUMBER[idx]
+
+Sources:
+    MASS            - Standard atomic weights. H to Kr keep the values
+                      get_rot_const has always used (chemicalelements.com,
+                      2015) with the Ni typo fixed, the rest are IUPAC
+                      2013. For elements without stable isotopes, the
+                      mass number of the longest-lived isotope.
+    COVALENT_RADIUS - Cordero et al., Dalton Trans. 2008, 2832 for Z <= 96
+                      (low spin for Mn, Fe, Co), Pyykko and Atsumi,
+                      Chem. Eur. J. 2009, 15, 186 above. In Angstroms.
+    VDW_RADIUS      - Bondi, J. Phys. Chem. 1964, 68, 441 with the main
+                      group completion of Mantina et al., J. Phys. Chem. A
+                      2009, 113, 5806. In Angstroms, NaN where not given.
+"""
+
+import numpy as np
+
+
+nan = float('nan')
+
+#         symbol  mass           r_cov  r_vdw
+_TABLE = [('H',   1.00794,       0.31,  1.10),
+          ('He',  4.002602,      0.28,  1.40),
+          ('Li',  6.941,         1.28,  1.82),
+          ('Be',  9.012182,      0.96,  1.53),
+          ('B',   10.811,        0.84,  1.92),
+          ('C',   12.0107,       0.76,  1.70),
+          ('N',   14.00674,      0.71,  1.55),
+          ('O',   15.9994,       0.66,  1.52),
+          ('F',   18.9984032,    0.57,  1.47),
+          ('Ne',  20.1797,       0.58,  1.54),
+          ('Na',  22.989770,     1.66,  2.27),
+          ('Mg',  24.3050,       1.41,  1.73),
+          ('Al',  26.981538,     1.21,  1.84),
+          ('Si',  28.0855,       1.11,  2.10),
+          ('P',   30.973761,     1.07,  1.80),
+          ('S',   32.066,        1.05,  1.80),
+          ('Cl',  35.4527,       1.02,  1.75),
+          ('Ar',  39.948,        1.06,  1.88),
+          ('K',   39.0983,       2.03,  2.75),
+          ('Ca',  40.078,        1.76,  2.31),
+          ('Sc',  44.955910,     1.70,  nan),
+          ('Ti',  47.867,        1.60,  nan),
+          ('V',   50.9415,       1.53,  nan),
+          ('Cr',  51.9961,       1.39,  nan),
+          ('Mn',  54.938049,     1.39,  nan),
+          ('Fe',  55.845,        1.32,  nan),
+          ('Co',  58.933200,     1.26,  nan),
+          ('Ni',  58.6934,       1.24,  1.63),
+          ('Cu',  63.546,        1.32,  1.40),
+          ('Zn',  65.39,         1.22,  1.39),
+          ('Ga',  69.723,        1.22,  1.87),
+          ('Ge',  72.61,         1.20,  2.11),
+          ('As',  74.92160,      1.19,  1.85),
+          ('Se',  78.96,         1.20,  1.90),
+          ('Br',  79.904,        1.20,  1.85),
+          ('Kr',  83.80,         1.16,  2.02),
+          ('Rb',  85.4678,       2.20,  3.03),
+          ('Sr',  87.62,         1.95,  2.49),
+          ('Y',   88.90584,      1.90,  nan),
+          ('Zr',  91.224,        1.75,  nan),
+          ('Nb',  92.90637,      1.64,  nan),
+          ('Mo',  95.95,         1.54,  nan),
+          ('Tc',  98.,           1.47,  nan),
+          ('Ru',  101.07,        1.46,  nan),
+          ('Rh',  102.90550,     1.42,  nan),
+          ('Pd',  106.42,        1.39,  1.63),
+          ('Ag',  107.8682,      1.45,  1.72),
+          ('Cd',  112.414,       1.44,  1.58),
+          ('In',  114.818,       1.42,  1.93),
+          ('Sn',  118.710,       1.39,  2.17),
+          ('Sb',  121.760,       1.39,  2.06),
+          ('Te',  127.60,        1.38,  2.06),
+          ('I',   126.90447,     1.39,  1.98),
+          ('Xe',  131.293,       1.40,  2.16),
+          ('Cs',  132.90545196,  2.44,  3.43),
+          ('Ba',  137.327,       2.15,  2.68),
+          ('La',  138.90547,     2.07,  nan),
+          ('Ce',  140.116,       2.04,  nan),
+          ('Pr',  140.90766,     2.03,  nan),
+          ('Nd',  144.242,       2.01,  nan),
+          ('Pm',  145.,          1.99,  nan),
+          ('Sm',  150.36,        1.98,  nan),
+          ('Eu',  151.964,       1.98,  nan),
+          ('Gd',  157.25,        1.96,  nan),
+          ('Tb',  158.92535,     1.94,  nan),
+          ('Dy',  162.500,       1.92,  nan),
+          ('Ho',  164.93033,     1.92,  nan),
+          ('Er',  167.259,       1.89,  nan),
+          ('Tm',  168.93422,     1.90,  nan),
+          ('Yb',  173.045,       1.87,  nan),
+          ('Lu',  174.9668,      1.87,  nan),
+          ('Hf',  178.49,        1.75,  nan),
+          ('Ta',  180.94788,     1.70,  nan),
+          ('W',   183.84,        1.62,  nan),
+          ('Re',  186.207,       1.51,  nan),
+          ('Os',  190.23,        1.44,  nan),
+          ('Ir',  192.217,       1.41,  nan),
+          ('Pt',  195.084,       1.36,  1.75),
+          ('Au',  196.966569,    1.36,  1.66),
+          ('Hg',  200.592,       1.32,  1.55),
+          ('Tl',  204.38,        1.45,  1.96),
+          ('Pb',  207.2,         1.46,  2.02),
+          ('Bi',  208.98040,     1.48,  2.07),
+          ('Po',  209.,          1.40,  1.97),
+          ('At',  210.,          1.50,  2.02),
+          ('Rn',  222.,          1.50,  2.20),
+          ('Fr',  223.,          2.60,  3.48),
+          ('Ra',  226.,          2.21,  2.83),
+          ('Ac',  227.,          2.15,  nan),
+          ('Th',  232.0377,      2.06,  nan),
+          ('Pa',  231.03588,     2.00,  nan),
+          ('U',   238.02891,     1.96,  1.86),
+          ('Np',  237.,          1.90,  nan),
+          ('Pu',  244.,          1.87,  nan),
+          ('Am',  243.,          1.80,  nan),
+          ('Cm',  247.,          1.69,  nan),
+          ('Bk',  247.,          1.68,  nan),
+          ('Cf',  251.,          1.68,  nan),
+          ('Es',  252.,          1.65,  nan),
+          ('Fm',  257.,          1.67,  nan),
+          ('Md',  258.,          1.73,  nan),
+          ('No',  259.,          1.76,  nan),
+          ('Lr',  266.,          1.61,  nan),
+          ('Rf',  267.,          1.57,  nan),
+          ('Db',  268.,          1.49,  nan),
+          ('Sg',  269.,          1.43,  nan),
+          ('Bh',  270.,          1.41,  nan),
+          ('Hs',  269.,          1.34,  nan),
+          ('Mt',  278.,          1.29,  nan),
+          ('Ds',  281.,          1.28,  nan),
+          ('Rg',  282.,          1.21,  nan),
+          ('Cn',  285.,          1.22,  nan),
+          ('Nh',  286.,          1.36,  nan),
+          ('Fl',  289.,          1.43,  nan),
+          ('Mc',  290.,          1.62,  nan),
+          ('Lv',  293.,          1.75,  nan),
+          ('Ts',  294.,          1.65,  nan),
+          ('Og',  294.,          1.57,  nan)]
+
+SYMBOLS = tuple(row[0] for row in _TABLE)
+NUMBER = np.arange(1, len(_TABLE)+1, dtype=np.intp)
+MASS = np.array([row[1] for row in _TABLE], dtype=np.float64)
+COVALENT_RADIUS = np.array([row[2] for row in _TABLE], dtype=np.float64)
+VDW_RADIUS = np.array([row[3] for row in _TABLE], dtype=np.float64)
+
+for _arr in (NUMBER, MASS, COVALENT_RADIUS, VDW_RADIUS):
+    _arr.flags.writeable = False
+
+_INDEX = dict((sym.lower(), i) for i, sym in enumerate(SYMBOLS))
+
+
+def index(label):
+    """
+    Return the table index (atomic number - 1) of a single atomic label.
+    Labels are case-insensitive. Raises KeyError for unknown labels.
+    """
+    try:
+        return _INDEX[label.strip().lower()]
+    except KeyError:
+        raise KeyError("'" + label + "' is not a known element")
+
+
+def intern(labels):
+    """
+    Map atomic labels to table indices. Each distinct label is looked up
+    once, so the cost is independent of the number of atoms.
+
+    Input: labels - Atomic labels, case-insensitive (iterable of String)
+
+    Output: idx - Table indices, usable to index NUMBER, MASS, etc.
+                  (numpy array of intp)
+    """
+    labels = np.asarray(labels, dtype=str)
+    if labels.size == 0:
+        return np.zeros(labels.shape, dtype=np.intp)
+    uniq, inverse = np.unique(labels, return_inverse=True)
+    table = np.array([index(label) for label in uniq], dtype=np.intp)
+    return table[inverse.reshape(labels.shape)]
+
+
+def numbers(labels):
+    """Atomic numbers of labels (numpy array of intp)"""
+    return NUMBER[intern(labels)]
+
+
+def masses(labels):
+    """Standard atomic weights of labels (numpy array of float64)"""
+    return MASS[intern(labels)]
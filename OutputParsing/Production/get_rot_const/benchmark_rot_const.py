@@ -0,0 +1,148 @@
+#! /usr/bin/env python
+
+"""
+Benchmark the stages of the get_rot_const pipeline.
+
+Writes synthetic Turbomole format coord files of increasing size and
+times read_coord, make_inertia_tensor and np.linalg.eig on each one
+separately. The atom, diatomic and linear edge cases are included, the
+first two taken from SampleInput. Results are written as JSON so a later
+run can be compared against them with --compare.
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+
+import numpy as np
+
+import get_rot_const as grc
+
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'SampleInput')
+SIZES = [3, 10, 100, 1000, 10000, 100000]
+STAGES = ['read_coord', 'make_inertia_tensor', 'eig']
+
+
+def write_coord(fil, xyz, labels):
+    """Write coordinates and labels to a Turbomole format coord file"""
+    with open(fil, 'w') as coord:
+        coord.write('$coord\n')
+        for (x, y, z), at in zip(xyz, labels):
+            coord.write('%20.14f  %20.14f  %20.14f  %5s\n' % (x, y, z, at))
+        coord.write('$end\n')
+
+
+def make_cases(directory, sizes=SIZES, seed=0):
+    """
+    Write the benchmark coord files to directory.
+
+    Input: directory - Where the files are written (String)
+           sizes     - Atom counts of the random molecules (list of int)
+           seed      - Seed of the random geometries (int)
+
+    Output: cases - Pairs of case name and coord file path (list)
+    """
+    rng = np.random.RandomState(seed)
+    elements = ['h', 'c', 'n', 'o', 's']
+    cases = [('atom', os.path.join(SAMPLE_DIR, 'coordAt')),
+             ('diatomic', os.path.join(SAMPLE_DIR, 'coordDiat'))]
+
+    fil = os.path.join(directory, 'coordLinear')
+    write_coord(fil, [[0, 0, 0], [0, 0, 2.2], [0, 0, -2.2]],
+                ['c', 'o', 'o'])
+    cases.append(('linear', fil))
+
+    for n in sizes:
+        # Roughly liquid density so the tensors look like real molecules
+        xyz = rng.uniform(0, 3.5*n**(1./3), size=(n, 3))
+        labels = [elements[i] for i in rng.randint(len(elements), size=n)]
+        fil = os.path.join(directory, 'coord' + str(n))
+        write_coord(fil, xyz, labels)
+        cases.append((str(n), fil))
+    return cases
+
+
+def time_call(func, args, repeat):
+    """Best wall time of repeat calls of func(*args), and its result"""
+    best = float('inf')
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run_benchmark(cases, repeat=3):
+    """
+    Time each stage on each case.
+
+    Output: results - Case name to dictionary of atom count and best
+                      time of each stage in seconds (dict)
+    """
+    results = {}
+    for name, fil in cases:
+        t_read, at_array = time_call(grc.read_coord, (fil,), repeat)
+        t_tens, itens = time_call(grc.make_inertia_tensor, (at_array,),
+                                  repeat)
+        t_eig, vals = time_call(np.linalg.eig, (itens,), repeat)
+        results[name] = {'atoms' : len(at_array), 'read_coord' : t_read,
+                         'make_inertia_tensor' : t_tens, 'eig' : t_eig}
+    return results
+
+
+def compare(results, reference):
+    """Print the speedup of results over reference for shared cases"""
+    print('%-10s %-20s %12s %12s %8s' % ('case', 'stage', 'reference',
+                                         'current', 'speedup'))
+    for name in results:
+        if name not in reference:
+            continue
+        for stage in STAGES:
+            old, new = reference[name][stage], results[name][stage]
+            print('%-10s %-20s %12.3e %12.3e %8.2f' % (name, stage, old, new,
+                                                       old/new))
+
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description='Times read_coord,'
+            + ' make_inertia_tensor and np.linalg.eig on synthetic coord'
+            + ' files from 3 to 100000 atoms and on the atom, diatomic'
+            + ' and linear edge cases. Results are written as JSON.')
+    parser.add_argument('-o', '--output', default='bench_rot_const.json',
+            help='File the results are written to.'
+            + ' (Default: bench_rot_const.json)')
+    parser.add_argument('-c', '--compare', default=None, help='Earlier'
+            + ' results file to report speedups against.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+            help='Atom counts of the synthetic molecules.')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Calls'
+            + ' per stage, the best time is kept. (Default: 3)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench_rot_const')
+    try:
+        results = run_benchmark(make_cases(directory, args.sizes),
+                                args.repeat)
+    finally:
+        shutil.rmtree(directory)
+
+    with open(args.output, 'w') as out:
+        json.dump({'python' : platform.python_version(),
+                   'numpy' : np.__version__,
+                   'machine' : platform.machine(),
+                   'results' : results}, out, indent=1, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare, 'r') as ref:
+            compare(results, json.load(ref)['results'])
+    else:
+        for name, res in results.items():
+            print('%-10s %7d atoms ' % (name, res['atoms'])
+                  + ' '.join('%s: %.3e s' % (stage, res[stage])
+                             for stage in STAGES))
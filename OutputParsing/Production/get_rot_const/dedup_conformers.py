@@ -0,0 +1,137 @@
+#! /usr/bin/env python
+
+"""
+Find near-duplicate conformers by their rotational constants.
+
+Walks directory trees for Turbomole format coord files, computes the
+rotational constants of each with get_rot_const and groups files whose
+A, B and C all agree within a relative tolerance. Grouping uses a KD-tree
+over the log-scaled constants, so a relative tolerance becomes a fixed
+radius, and leader clustering, so the search stays close to linear in
+the number of files even when most of them are duplicates. One
+representative per cluster can be listed for passing on to autoDefine
+or subJobs.
+"""
+
+import argparse
+import itertools
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import get_rot_const as grc
+
+
+# Log coordinate given to moments absent for atoms and linear molecules.
+# Far enough from any real constant that only missing moments match it
+MISSING = -1.0e3
+
+
+def cluster_rot_consts(rots, tol=1e-3, keys=None):
+    """
+    Group systems whose rotational constants all agree within a relative
+    tolerance. Leader clustering is used: the first system not yet in a
+    cluster starts one and takes every unassigned system whose constants
+    all lie within a factor 1+tol of its own. Each system is visited by
+    one neighbourhood query as a leader at most, so near-identical sets
+    cost close to linear time rather than one step per matching pair.
+
+    Constants alone cannot tell atoms, or linear molecules of the same B,
+    of different elements apart. Systems with absent moments therefore
+    only cluster with systems of equal key, and atoms given no key are
+    left in clusters of their own.
+
+    Input:
+    rots - Rotational constants as returned by get_rot_const, negative
+           for absent moments. (Type: M x 3 array-like)
+    tol  - Relative tolerance. (Type: float)
+    keys - Optional hashable per system, e.g. its sorted atom labels,
+           that systems must share to be clustered. (Type: M list)
+
+    Output:
+    labels - Cluster index of each system, numbered in order of first
+             appearance. (Type: M numpy array of int)
+    """
+    rots = np.asarray(rots, dtype=np.float64).reshape(-1, 3)
+    logs = np.full(rots.shape, MISSING)
+    present = rots > 0
+    logs[present] = np.log(rots[present])
+
+    if keys is None:
+        keys = [None]*len(rots)
+    groups = {}
+    for i, key in enumerate(keys):
+        if not present[i].any() and key is None:
+            key = ('atom', i)
+        groups.setdefault(key, []).append(i)
+
+    raw = np.full(len(rots), -1, dtype=np.intp)
+    radius = np.log1p(tol)
+    for members in groups.values():
+        members = np.array(members, dtype=np.intp)
+        tree = cKDTree(logs[members])
+        assigned = np.zeros(len(members), dtype=bool)
+        for j in range(len(members)):
+            if assigned[j]:
+                continue
+            near = np.array(tree.query_ball_point(logs[members[j]], radius,
+                                                  p=np.inf), dtype=np.intp)
+            near = near[~assigned[near]]
+            assigned[near] = True
+            raw[members[near]] = members[j]
+
+    # Renumber by first appearance
+    leaders, first, inverse = np.unique(raw, return_index=True,
+                                        return_inverse=True)
+    rank = np.empty(len(leaders), dtype=np.intp)
+    rank[np.argsort(first)] = np.arange(len(leaders))
+    return rank[inverse.reshape(-1)]
+
+
+def formula_key(fil):
+    """Sorted atom labels of a coord file, the key of cluster_rot_consts"""
+    return ' '.join(sorted(at[3].lower() for at in grc.read_coord(fil)))
+
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description='Searches directory trees'
+            + ' for Turbomole format coord files and reports groups of'
+            + ' files whose rotational constants agree within a relative'
+            + ' tolerance, i.e. likely duplicate conformers.')
+    parser.add_argument('roots', nargs='*', default=['.'], help='Directories'
+            + ' to search. (Default: .)')
+    parser.add_argument('-n', '--name', default='coord', help='Name of the'
+            + ' coord files searched for, may hold shell wildcards.'
+            + ' (Default: coord)')
+    parser.add_argument('--tol', type=float, default=1e-3, help='Relative'
+            + ' tolerance on each rotational constant. (Default: 1e-3)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number'
+            + ' of worker processes. (Default: 1)')
+    parser.add_argument('-r', '--representatives', action='store_true',
+            help='Only print one file per cluster, one per line.')
+    args = parser.parse_args()
+
+    fils, rots = [], []
+    coords = itertools.chain(*[grc.crawl_coords(root, args.name)
+                               for root in args.roots])
+    for fil, vals, err in grc.map_rot_const(coords, args.jobs):
+        if err is not None:
+            grc.report_rot_const(fil, vals, err)
+            continue
+        fils.append(fil)
+        rots.append(vals)
+
+    # Atoms and linear molecules are told apart by their atoms
+    keys = [formula_key(fil) if min(vals) <= 0 else None
+            for fil, vals in zip(fils, rots)]
+    labels = cluster_rot_consts(rots, args.tol, keys) if fils else []
+    clusters = {}
+    for fil, label in zip(fils, labels):
+        clusters.setdefault(label, []).append(fil)
+
+    for label in sorted(clusters):
+        members = clusters[label]
+        if args.representatives:
+            print(members[0])
+        else:
+            print('Cluster ' + str(label+1) + ' - ' + ' '.join(members))
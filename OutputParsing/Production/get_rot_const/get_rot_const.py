@@ -12,7 +12,32 @@ files as argument.
 
 import numpy as np
 import sys
+import os
 import argparse
+import multiprocessing
+import itertools
+import hashlib
+import json
+import socketserver
+import signal
+import struct
+import csv
+import io
+import fnmatch
+import sqlite3
+
+import rot_cache
+import rot_const_client
+
+# The shared periodic table lives in Common/ at the top of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', '..', 'Common'))
+import elements
+
+
+# Change whenever the computed constants change (e.g. new atomic
+# weights) so stale cache entries are no longer found
+CACHE_VERSION = 'elements-2'
 
 
 class KnownError(Exception):
@@ -28,31 +53,269 @@ def get_atom_weight(atom):
     atom - The atomic label (Type: String)
 
     Output:
-    dict[atom] - Atomic weight of atom. (Type: float)
+    Atomic weight of atom, from the shared periodic table. (Type: float)
+    """
+    try:
+        return float(elements.MASS[elements.index(atom)])
+    except KeyError:
+        raise KnownError("'" + atom + "' isn't a known element.")
+
+
+def get_isotope_weight(isotope):
     """
+    Look-up table for isotopic masses given isotope labels
 
-    # atomic masses ( in 'g/mol' aka. 'u' - often written 'amu' ) taken from: 
-    # <http://www.chemicalelements.com/show/mass.html> 7/31/15 by Matt Agee
-    dict={'h'  : 1.00794,   'he' : 4.002602,'li' : 6.941,    'be' : 9.012182,
-          'b'  : 10.811,    'c'  : 12.0107, 'n'  : 14.00674, 'o'  : 15.9994, 
-          'f'  : 18.9984032,'ne' : 20.1797, 'na' : 22.989770,'mg' : 24.3050, 
-          'al' : 26.981538, 'si' : 28.0855, 'p'  : 30.973761,'s'  : 32.066,  
-          'cl' : 35.4527,   'ar' : 39.948,  'k'  : 39.0983,  'ca' : 40.078,  
-          'sc' : 44.955910, 'ti' : 47.867,  'v'  : 50.9415,  'cr' : 51.9961, 
-          'mn' : 54.938049, 'fe' : 55.845,  'co' : 58.933200,'ni' : 58.9634, 
-          'cu' : 63.546,    'zn' : 65.39,   'ga' : 69.723,   'ge' : 72.61,   
-          'as' : 74.92160,  'se' : 78.96,   'br' : 79.904,   'kr' : 83.80}
-    
+    Input:
+    isotope - Mass number followed by the atomic label, e.g. '13c'. 
+              'd' and 't' are accepted for '2h' and '3h'. (Type: String)
+
+    Output:
+    dict[isotope] - Isotopic mass of isotope. (Type: float)
+    """
+
+    # isotopic masses ( in 'u' ) taken from the AME2016 atomic mass 
+    # evaluation as tabulated by NIST
+    dict={'1h'  : 1.00782503223, '2h'  : 2.01410177812, 
+          '3h'  : 3.01604927790, '10b' : 10.01293695,
+          '11b' : 11.00930536,   '12c' : 12.0000000000,
+          '13c' : 13.00335483507,'14n' : 14.00307400443,
+          '15n' : 15.00010889888,'16o' : 15.99491461957,
+          '17o' : 16.99913175650,'18o' : 17.99915961286,
+          '19f' : 18.99840316273,'28si': 27.97692653465,
+          '29si': 28.97649466490,'30si': 29.973770136,
+          '31p' : 30.97376199842,'32s' : 31.9720711744,
+          '33s' : 32.9714589098, '34s' : 33.967867004,
+          '35cl': 34.968852682,  '37cl': 36.965902602,
+          '79br': 78.9183376,    '81br': 80.9162897}
+
+    isotope = {'d' : '2h', 't' : '3h'}.get(isotope, isotope)
     try:
-        return dict[atom]
+        return dict[isotope]
     except KeyError:
-        raise KnownError("'" + atom + "' isn't in the dictionary yet.")
+        raise KnownError("'" + isotope + "' isn't in the isotope dictionary"
+                + " yet.")
 
 
-def make_inertia_tensor(xyz_at):
+def isotope_element(isotope):
+    """Return the atomic label of an isotope label, e.g. '13c' -> 'c'"""
+    return {'d' : 'h', 't' : 'h'}.get(isotope, isotope.lstrip('0123456789'))
+
+
+def get_atom_weights(labels):
     """
-    Given a system's atomic coordinates and atomic labels return its inertia
-    tensor. 
+    Vectorized version of get_atom_weight. Labels are interned to 
+    periodic table indices once per distinct label, so the cost of the
+    lookup is independent of system size.
+
+    Input:
+    labels - Atomic labels. (Type: N iterable of String)
+
+    Output:
+    weights - Atomic weights in the same order as labels. 
+              (Type: N numpy array of float64)
+    """
+    try:
+        return elements.masses(labels)
+    except KeyError as err:
+        raise KnownError(err.args[0].replace('is not', "isn't") + '.')
+
+
+def inertia_tensor(xyz, weights):
+    """
+    Inertia tensor of a single system about its center of mass, built
+    with array reductions instead of a loop over atoms. 
+
+    Input:
+    xyz     - Atomic coordinates. (Type: N x 3 array-like of float)
+    weights - Atomic weights. (Type: N array-like of float)
+
+    Output:
+    itens - The inertia tensor. (Type: 3 x 3 numpy array)
+    """
+    xyz = np.asarray(xyz, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    return batch_inertia_tensors(xyz, weights, [0, len(xyz)])[0]
+
+
+def batch_inertia_tensors(xyz, weights, offsets):
+    """
+    Inertia tensors of many systems at once. The systems are stacked
+    into one coordinate array and delimited by offsets, so molecules
+    of different sizes can share a single batch. 
+
+    Input:
+    xyz     - Stacked atomic coordinates of all systems. 
+              (Type: N x 3 array-like of float)
+    weights - Stacked atomic weights. (Type: N array-like of float)
+    offsets - Start of each system in xyz, followed by N. System i is 
+              xyz[offsets[i]:offsets[i+1]]. (Type: M+1 array-like of int)
+
+    Output:
+    itens - The inertia tensors. (Type: M x 3 x 3 numpy array)
+    """
+    xyz = np.asarray(xyz, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.intp)
+
+    assert xyz.ndim == 2 and xyz.shape[1] == 3, \
+        'Coordinates passed to batch_inertia_tensors must have shape (N,3)'
+    assert weights.shape == (len(xyz),), \
+        'Weights passed to batch_inertia_tensors must have shape (N,)'
+    assert len(offsets) > 1 and offsets[0] == 0 \
+        and offsets[-1] == len(xyz), \
+        'Offsets must start at 0 and end at the number of atoms'
+    counts = np.diff(offsets)
+    assert np.all(counts > 0), \
+        'Empty system passed to batch_inertia_tensors, check coord file'
+
+    starts = offsets[:-1]
+    tot_weight = np.add.reduceat(weights, starts)
+    com = np.add.reduceat(xyz*weights[:, None], starts)/tot_weight[:, None]
+
+    # Shift every atom to the center of mass of its own system, then
+    # I = sum_i m_i (r_i.r_i 1 - r_i r_i^T)
+    rel = xyz - np.repeat(com, counts, axis=0)
+    wrel = rel*weights[:, None]
+    second = np.add.reduceat(wrel[:, :, None]*rel[:, None, :], starts)
+    trace = np.trace(second, axis1=1, axis2=2)
+
+    return trace[:, None, None]*np.eye(3) - second
+
+
+def batch_rot_const(xyz, weights, offsets):
+    """
+    Rotational constants (in MHz) of many systems from a single 
+    eigvalsh call over the stacked inertia tensors. See 
+    batch_inertia_tensors for the meaning of the arguments.
+
+    Output:
+    vals - Rotational constants of each system sorted largest to 
+           smallest. Moments missing for atoms and linear molecules
+           are reported as negative values, as in get_rot_const.
+           (Type: M x 3 numpy array)
+    """
+    return moments_to_rot_const(
+        np.linalg.eigvalsh(batch_inertia_tensors(xyz, weights, offsets)))
+
+
+def moments_to_rot_const(moments):
+    """
+    Convert principal moments of inertia (in amu bohr^2) to rotational 
+    constants (in MHz). 
+
+    Input:
+    moments - Principal moments of inertia. (Type: ... x 3 array-like)
+
+    Output:
+    vals - Rotational constants sorted largest to smallest along the 
+           last axis. Moments below tolerance (atoms and linear 
+           molecules) give negative values. (Type: ... x 3 numpy array)
+    """
+    # Conversion factors and coeffs to get hbar^2/2I in units of MHz. 
+    co = 1.804741074*10**6 
+    tol = 10**(-8)
+
+    moments = np.array(moments, dtype=np.float64)
+    # Atoms and linear molecules have less than 3 moments of inertia. 
+    # The excess moments of inertia are 0-valued
+    moments[moments < tol] = -1
+
+    vals = co/moments
+    return -np.sort(-vals, axis=-1)
+
+
+def isotopologue_rot_const(xyz, masses):
+    """
+    Rotational constants (in MHz) of many isotopologues of one geometry.
+    The per-atom second moments are formed once, after which every 
+    isotopologue costs a matrix product and one eigvalsh call is made 
+    for the whole set. 
+
+    Input:
+    xyz    - Atomic coordinates shared by all isotopologues. 
+             (Type: N x 3 array-like of float)
+    masses - Atomic masses of each isotopologue, one per row. 
+             (Type: K x N array-like of float)
+
+    Output:
+    vals - Rotational constants of each isotopologue, as in 
+           batch_rot_const. (Type: K x 3 numpy array)
+    """
+    xyz = np.asarray(xyz, dtype=np.float64)
+    masses = np.atleast_2d(np.asarray(masses, dtype=np.float64))
+    assert xyz.ndim == 2 and xyz.shape[1] == 3, \
+        'Coordinates passed to isotopologue_rot_const must have shape (N,3)'
+    assert masses.shape[1] == len(xyz), \
+        'Masses passed to isotopologue_rot_const must have shape (K,N)'
+
+    # Work about the geometric center to keep the subtraction below 
+    # numerically benign, the tensor itself is origin independent
+    xyz = xyz - xyz.mean(axis=0)
+    outer = (xyz[:, :, None]*xyz[:, None, :]).reshape(len(xyz), 9)
+
+    tot_weight = masses.sum(axis=1)
+    first = masses.dot(xyz)
+    second = masses.dot(outer).reshape(-1, 3, 3) \
+           - first[:, :, None]*first[:, None, :]/tot_weight[:, None, None]
+    trace = np.trace(second, axis1=1, axis2=2)
+    itens = trace[:, None, None]*np.eye(3) - second
+
+    return moments_to_rot_const(np.linalg.eigvalsh(itens))
+
+
+def isotopologue_masses(labels, subs=('13c', 'd', '15n', '18o'), order=2):
+    """
+    Build the mass matrix of every isotopologue reachable by replacing 
+    up to order atoms with the isotopes in subs. Atoms not substituted 
+    carry the mass of their most abundant isotope when it is known and 
+    their average atomic weight otherwise. Labels and isotopes may be 
+    given in any case.
+
+    Input:
+    labels - Atomic labels of the parent molecule. (Type: N list of String)
+    subs   - Isotope labels understood by get_isotope_weight, at most one
+             per element. (Type: iterable of String)
+    order  - Maximum number of atoms substituted at once. (Type: int)
+
+    Output:
+    patterns - Substitutions of each isotopologue as tuples of 
+               (atom index, isotope). The parent is the empty tuple 
+               first in the list. (Type: K list of tuple)
+    masses   - Atomic masses of each isotopologue. 
+               (Type: K x N numpy array)
+    """
+    main = {'h' : '1h', 'b' : '11b', 'c' : '12c', 'n' : '14n', 'o' : '16o',
+            'f' : '19f', 'si' : '28si', 'p' : '31p', 's' : '32s', 
+            'cl' : '35cl', 'br' : '79br'}
+    labels = [at.lower() for at in labels]
+    subs = [isotope.strip().lower() for isotope in subs]
+    parent = np.array([get_isotope_weight(main[at]) if at in main
+                       else get_atom_weight(at) for at in labels],
+                      dtype=np.float64)
+
+    by_element = {}
+    for isotope in subs:
+        get_isotope_weight(isotope)
+        by_element[isotope_element(isotope)] = isotope
+    sites = [(i, by_element[at]) for i, at in enumerate(labels)
+             if at in by_element]
+
+    patterns = [()]
+    for n in range(1, order+1):
+        patterns.extend(itertools.combinations(sites, n))
+
+    masses = np.tile(parent, (len(patterns), 1))
+    for k, pattern in enumerate(patterns):
+        for i, isotope in pattern:
+            masses[k, i] = get_isotope_weight(isotope)
+
+    return patterns, masses
+
+
+def split_xyz_at(xyz_at):
+    """
+    Check a system's atomic coordinates and atomic labels and split them
+    into coordinates and atomic weights. 
 
     Input:
     xyz_at - 2D list with format [ [x1,y1,z1,at1] , [x2,y2,z2,at2], ... ].
@@ -60,7 +323,8 @@ def make_inertia_tensor(xyz_at):
              get_atom_weight. (Type: N x 4 iterable)
 
     Output:
-    itens - The inertia tensor, output as a 2D array. (Type: list)
+    xyz     - Atomic coordinates. (Type: N x 3 numpy array)
+    weights - Atomic weights. (Type: N numpy array)
     """
     # Check iterable
     assert hasattr(xyz_at,'__iter__'), \
@@ -74,11 +338,6 @@ def make_inertia_tensor(xyz_at):
         raise KnownError('Iterable passed to make_inertia_tensor must'
                 + ' have a length')
 
-    ixx = ixy = ixz = iyy = iyz = izz = 0
-    tot_weight = 0
-    com = np.array([0, 0, 0],dtype=np.float64)
-    # With some algebra each inertia tensor entry can be put in a form
-    # requiring a single loop to build.  
     for entry in xyz_at:
         try:
             assert len(entry) == 4,'Entries of xyz_at must have 4 entries'
@@ -88,40 +347,31 @@ def make_inertia_tensor(xyz_at):
         try:
             assert isinstance(entry[3],str), \
                 'Entries of xyz_at must have a string as their fourth entry'
-            at_weight = get_atom_weight(entry[3])
-            entry = np.array(list(map(np.float64, entry[0:3])))
-        except ValueError:
-            raise KnownError('Entries of xyz_at must have floats as their'
-                    + ' first 3 entries')
         except TypeError:
             raise KnownError('Entries of xyz_at must be indexable')
 
-        tot_weight += at_weight
-
-        ixx += (entry[1]**2 + entry[2]**2)*at_weight
-        iyy += (entry[0]**2 + entry[2]**2)*at_weight
-        izz += (entry[0]**2 + entry[1]**2)*at_weight
+    try:
+        xyz = np.array([entry[0:3] for entry in xyz_at], dtype=np.float64)
+    except (ValueError, TypeError):
+        raise KnownError('Entries of xyz_at must have floats as their'
+                + ' first 3 entries')
+    weights = get_atom_weights([entry[3] for entry in xyz_at])
 
-        ixy -= (entry[0]*entry[1])*at_weight
-        ixz -= (entry[0]*entry[2])*at_weight
-        iyz -= (entry[1]*entry[2])*at_weight
+    return xyz, weights
 
-        com += entry*at_weight
 
-    # Note com must be divided by tot_weight to be
-    # center of mass coordinates here. 
-    ixx -= (com[1]**2 + com[2]**2)/tot_weight
-    iyy -= (com[0]**2 + com[2]**2)/tot_weight
-    izz -= (com[0]**2 + com[1]**2)/tot_weight
+def make_inertia_tensor(xyz_at):
+    """
+    Given a system's atomic coordinates and atomic labels return its inertia
+    tensor. 
 
-    ixy += (com[0]*com[1])/tot_weight
-    ixz += (com[0]*com[2])/tot_weight
-    iyz += (com[1]*com[2])/tot_weight
+    Input:
+    xyz_at - As for split_xyz_at. (Type: N x 4 iterable)
 
-    itens = [ [ixx, ixy, ixz],
-              [ixy, iyy, iyz],
-              [ixz, iyz, izz] ]
-    return itens
+    Output:
+    itens - The inertia tensor, output as a 2D array. (Type: list)
+    """
+    return inertia_tensor(*split_xyz_at(xyz_at)).tolist()
 
 
 def read_coord(fil):
@@ -140,10 +390,22 @@ def read_coord(fil):
         coord = open(fil, 'r')
     except IOError:
         raise KnownError('Could not open file '+fil+' for reading.')
+    with coord:
+        return parse_coord(coord, fil)
+
+
+def parse_coord(lines, fil='<string>'):
+    """
+    Read the entries of the $coord block in lines. See read_coord.
+
+    Input:
+    lines - Lines of a Turbomole format coord file. (Type: iterable)
+    fil   - Name used in error messages. (Type: String)
+    """
     at_array = []
     started=False
     lc = 0
-    for line in coord:
+    for line in lines:
         lc += 1
         if line.find('$coord') != -1 :
             started = True
@@ -181,23 +443,684 @@ def get_rot_const(fil):
     vals - List of rotational constants in MHz (float), sorted 
            largest to smallest (Type: list)
     """
-    # Conversion factors and coeffs to get hbar^2/2I in units of MHz. 
+    return at_array_rot_const(read_coord(fil))
+
+
+def at_array_rot_const(at_array):
+    """Rotational constants of the entries read by read_coord"""
+    itens = make_inertia_tensor(at_array)
+    vals = moments_to_rot_const(np.linalg.eigvalsh(itens))
+
+    return vals.tolist()
+
+
+def rot_const_jacobian(xyz, weights):
+    """
+    Rotational constants (in MHz) of a system together with their 
+    analytic derivatives with respect to every Cartesian coordinate. 
+
+    For a nondegenerate principal moment I_k = v_k^T I v_k the first 
+    order perturbation result dI_k = v_k^T dI v_k gives
+        dI_k/dr_j = 2 m_j (r_j - (v_k.r_j) v_k)
+    with r_j relative to the center of mass, whose own motion drops out.
+    The constants follow from B_k = co/I_k. Derivatives of degenerate 
+    moments (symmetric tops) are not unique, and those of absent moments
+    (atoms and linear molecules) are reported as 0. 
+
+    Input:
+    xyz     - Atomic coordinates in Bohr radii. (Type: N x 3 array-like)
+    weights - Atomic weights. (Type: N array-like of float)
+
+    Output:
+    vals - Rotational constants sorted largest to smallest, negative for
+           absent moments as in get_rot_const. (Type: 3 numpy array)
+    jac  - jac[k, j, a] is the derivative of vals[k] with respect to 
+           coordinate a of atom j, in MHz/Bohr. (Type: 3 x N x 3 array)
+    """
+    # Conversion factor of moments_to_rot_const
     co = 1.804741074*10**6 
     tol = 10**(-8)
 
-    at_array = read_coord(fil)
-    itens = make_inertia_tensor(at_array)
-    vals, vects = np.linalg.eig(itens)
+    xyz = np.asarray(xyz, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    moments, vects = np.linalg.eigh(inertia_tensor(xyz, weights))
 
-    # Atoms and linear molecules have less than 3 moments of inertia. 
-    # The excess moments of inertia are 0-valued
-    for i in range(len(vals)):
-        if vals[i] < tol:
-            vals[i] = -1
+    rel = xyz - weights.dot(xyz)/weights.sum()
+    # proj[k, j] = v_k.r_j
+    proj = vects.T.dot(rel.T)
+    dmom = 2*weights[None, :, None]*(rel[None, :, :]
+                                     - proj[:, :, None]*vects.T[:, None, :])
+
+    present = moments >= tol
+    scale = np.zeros(3)
+    scale[present] = -co/moments[present]**2
+
+    # Absent moments sort last, as in moments_to_rot_const
+    vals = co/np.where(present, moments, -1)
+    order = np.argsort(-vals, kind='stable')
+    return vals[order], (scale[:, None, None]*dmom)[order]
+
+
+def get_rot_const_jacobian(fil):
+    """
+    Calculates the 3 rotational constants for a molecule (in MHz) and 
+    their derivatives with respect to the 3N Cartesian coordinates. See
+    rot_const_jacobian. 
+
+    Input:
+    fil - String with path to Turbomole format coord file. 
+          Assumes units of Bohr radii. (Type: String)
+
+    Output:
+    vals - Rotational constants sorted largest to smallest. (Type: list)
+    jac  - Derivatives in MHz/Bohr, ordered x1, y1, z1, x2, ... along 
+           the second axis. (Type: 3 x 3N numpy array)
+    """
+    vals, jac = rot_const_jacobian(*split_xyz_at(read_coord(fil)))
+    return vals.tolist(), jac.reshape(3, -1)
+
+
+def _coord_frames(lines, name):
+    """
+    Yield every $coord block found in lines as a frame. Used for 
+    coord and mdlog files, the latter holding one block per MD step.
+    """
+    xyz = labels = None
+    for lc, line in enumerate(lines, 1):
+        if line.find('$coord') != -1 :
+            xyz, labels = [], []
+        elif line.find('$') != -1 :
+            if xyz:
+                yield xyz, labels
+            xyz = labels = None
+        elif xyz is not None :
+            entry = line.split()
+            assert len(entry) == 4, \
+                'Line '+str(lc)+' in '+name+' must have 4 entries'
+            try:
+                xyz.append([float(x) for x in entry[0:3]])
+            except ValueError:
+                raise KnownError('Line '+str(lc)+' in '+name+' must have'
+                        + ' floats for its first 3 entries')
+            labels.append(entry[3])
+    if xyz:
+        yield xyz, labels
+
+
+def _gradient_frames(lines, name):
+    """
+    Yield the geometry of every cycle in a Turbomole gradient file. 
+    Each cycle line is followed by the atomic coordinates (4 entries) 
+    and then the gradient (3 entries), only the former are kept. 
+    """
+    xyz = labels = None
+    for lc, line in enumerate(lines, 1):
+        entry = line.split()
+        if line.find('cycle') != -1 or line.find('$') != -1 :
+            if xyz:
+                yield xyz, labels
+            xyz, labels = ([], []) if line.find('cycle') != -1 else \
+                          (None, None)
+        elif xyz is not None and len(entry) == 4 :
+            try:
+                xyz.append([float(x.replace('D','E').replace('d','e'))
+                            for x in entry[0:3]])
+            except ValueError:
+                raise KnownError('Line '+str(lc)+' in '+name+' must have'
+                        + ' floats for its first 3 entries')
+            labels.append(entry[3])
+    if xyz:
+        yield xyz, labels
+
+
+def _xyz_frames(lines, name):
+    """
+    Yield every frame of a multi-frame xyz file. Coordinates are 
+    converted from Angstroms to Bohr radii to match coord files. 
+    """
+    ang_2_bohr = 1.889725989
+
+    lines = iter(lines)
+    lc = 0
+    for line in lines:
+        lc += 1
+        if line.strip() == '':
+            continue
+        try:
+            n = int(line)
+        except ValueError:
+            raise KnownError('Line '+str(lc)+' in '+name+' must hold the'
+                    + ' number of atoms in the frame')
+        next(lines, None)
+        lc += 1
+
+        xyz, labels = [], []
+        for entry in itertools.islice(lines, n):
+            lc += 1
+            entry = entry.split()
+            assert len(entry) >= 4, \
+                'Line '+str(lc)+' in '+name+' must have 4 entries'
+            try:
+                xyz.append([float(x)*ang_2_bohr for x in entry[1:4]])
+            except ValueError:
+                raise KnownError('Line '+str(lc)+' in '+name+' must have'
+                        + ' floats for its last 3 entries')
+            labels.append(entry[0].lower())
+        assert len(xyz) == n, 'Last frame of '+name+' is truncated'
+        yield xyz, labels
+
+
+def detect_trajectory_format(fil):
+    """
+    Guess the trajectory format of fil from its name and first line.
+
+    Output:
+    f_type - One of 'gradient', 'mdlog', 'xyz' or 'coord'. (Type: String)
+    """
+    base = fil.split('/')[-1].lower()
+    if base.startswith('gradient'):
+        return 'gradient'
+    elif base.startswith('mdlog'):
+        return 'mdlog'
+    elif base.endswith('.xyz'):
+        return 'xyz'
+
+    try:
+        with open(fil, 'r') as traj:
+            first = traj.readline()
+    except IOError:
+        raise KnownError('Could not open file '+fil+' for reading.')
+    if first.strip().isdigit():
+        return 'xyz'
+    elif first.find('$grad') != -1:
+        return 'gradient'
+    return 'coord'
+
+
+def iter_frames(fil, f_type=None):
+    """
+    Read the geometries of a multi-frame file one frame at a time, so 
+    memory use does not grow with the length of the trajectory.
+
+    Input:
+    fil    - String with path to a gradient, mdlog, coord or multi-frame
+             xyz file. (Type: String)
+    f_type - File type, determined by detect_trajectory_format if None.
+             (Type: String)
+
+    Output:
+    Generator of (xyz, labels) tuples. xyz holds the coordinates of a 
+    frame in Bohr radii, labels the atomic labels. (Type: tuple)
+    """
+    readers = {'gradient' : _gradient_frames, 'mdlog' : _coord_frames,
+               'coord' : _coord_frames, 'xyz' : _xyz_frames}
+    if f_type is None:
+        f_type = detect_trajectory_format(fil)
+    if f_type not in readers:
+        raise KnownError("Trajectory format '"+f_type+"' is not supported.")
+
+    try:
+        traj = open(fil, 'r')
+    except IOError:
+        raise KnownError('Could not open file '+fil+' for reading.')
+    with traj:
+        for xyz, labels in readers[f_type](traj, fil):
+            yield xyz, labels
+
+
+def stream_rot_const(fil, f_type=None, batch=4096):
+    """
+    Calculate the rotational constants (in MHz) of every frame of a 
+    trajectory. Frames are read lazily and evaluated batch frames at a 
+    time with batch_rot_const, bounding memory use. 
+
+    Input:
+    fil    - String with path to the trajectory. See iter_frames. 
+    f_type - File type, see iter_frames. (Type: String)
+    batch  - Number of frames evaluated together. (Type: int)
+
+    Output:
+    Generator of the rotational constants of each frame, sorted 
+    largest to smallest as in get_rot_const. (Type: 3 numpy array)
+    """
+    # Labels rarely change along a trajectory, so remember the weights
+    # of the last set seen instead of looking them up every frame
+    last_labels = last_weights = None
+
+    frames = iter_frames(fil, f_type)
+    while True:
+        chunk = list(itertools.islice(frames, batch))
+        if not chunk:
+            break
+
+        weights = []
+        for xyz, labels in chunk:
+            if labels != last_labels:
+                last_labels, last_weights = labels, get_atom_weights(labels)
+            weights.append(last_weights)
+
+        counts = [len(xyz) for xyz, labels in chunk]
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        xyz = np.concatenate([np.asarray(xyz, dtype=np.float64) 
+                              for xyz, labels in chunk])
+        for rots in batch_rot_const(xyz, np.concatenate(weights), offsets):
+            yield rots
+
+
+def try_rot_const(fil):
+    """
+    Run get_rot_const on a single file, catching the anticipated errors
+    so one bad file does not stop a run over many. Safe to use as a 
+    process pool worker.
+
+    Input:
+    fil - String with path to Turbomole format coord file. (Type: String)
+
+    Output:
+    (fil, rots, err) - rots is the output of get_rot_const, or None if 
+                       it failed, in which case err holds the error 
+                       message. (Type: tuple)
+    """
+    try:
+        return fil, get_rot_const(fil), None
+    except (AssertionError, KnownError) as err:
+        return fil, None, str(err)
+
+
+def crawl_coords(root, name='coord'):
+    """
+    Find files called name below root, yielding each one as soon as its
+    directory has been listed so work can start before the traversal 
+    ends. Each directory is read with a single os.scandir call, and 
+    entries are visited in sorted order for reproducible output. 
+    Symbolic links to directories are not followed. 
+
+    Input:
+    root - String with path of the directory to search. (Type: String)
+    name - File name to match, may hold shell wildcards. (Type: String)
+
+    Output:
+    Generator of paths to the matching files. 
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = sorted(os.scandir(directory), key=lambda e: e.name)
+        except OSError as err:
+            print('Error: Could not list directory '+directory+': '
+                + str(err.strerror), file=sys.stderr)
+            continue
+
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif fnmatch.fnmatchcase(entry.name, name) and \
+                        entry.is_file():
+                    yield entry.path
+            except OSError:
+                continue
+        # Reversed so subdirectories are visited in sorted order
+        stack.extend(reversed(subdirs))
+
+
+def coord_hash(fil):
+    """
+    Hash the contents of the $coord block of a Turbomole format coord 
+    file. Whitespace within lines is normalized so only the geometry
+    and labels determine the key.
+
+    Input:
+    fil - String with path to Turbomole format coord file. (Type: String)
 
-    vals = co/vals
+    Output:
+    key - Hex digest of the $coord block. (Type: String)
+    """
+    try:
+        coord = open(fil, 'r')
+    except IOError:
+        raise KnownError('Could not open file '+fil+' for reading.')
 
-    return sorted(vals, reverse=True)
+    # Keys from earlier versions of the calculation must not match
+    block = hashlib.sha1(CACHE_VERSION.encode())
+    started = False
+    with coord:
+        for line in coord:
+            if line.find('$coord') != -1 :
+                started = True
+            elif line.find('$') != -1 :
+                started = False
+            elif started :
+                block.update((' '.join(line.split()) + '\n').encode())
+    return block.hexdigest()
+
+
+def try_coord_hash(fil):
+    """
+    coord_hash for use as a process pool worker, returning None for
+    files that cannot be read so try_rot_const can report the error.
+    """
+    try:
+        return coord_hash(fil)
+    except KnownError:
+        return None
+
+
+def cache_warning(err):
+    """Warn that the cache is not used from here on, returns None"""
+    print('Warning: Cache unavailable (' + str(err) + '), continuing'
+        + ' without it', file=sys.stderr)
+    return None
+
+
+def map_rot_const(fils, jobs=1, cache=None, refresh=False, window=1024):
+    """
+    Apply try_rot_const to each file in fils. With jobs > 1 the files
+    are spread over a process pool. Results are yielded in input order 
+    either way.
+
+    If a rot_cache.RotConstCache is supplied, files whose $coord block
+    is already cached are not recomputed and new results are stored. 
+    The cache is consulted window files at a time, their keys hashed
+    by the workers so the reads overlap. If the cache fails, a warning
+    is printed and the remaining files are computed without it.
+
+    Input:
+    fils    - Paths to Turbomole format coord files. (Type: iterable)
+    jobs    - Number of worker processes. (Type: int)
+    cache   - Cache of earlier results, or None. (Type: RotConstCache)
+    refresh - Recompute everything, overwriting cached results. (Type: bool)
+    window  - Number of files looked up in the cache at once. (Type: int)
+
+    Output:
+    Generator of try_rot_const results. 
+    """
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+    # Files are cheap to process, so hand them out in chunks to
+    # keep the interprocess traffic down
+    spread = (lambda func, fils: pool.imap(func, fils, chunksize=16)) \
+        if pool else map
+    compute = lambda fils: spread(try_rot_const, fils)
+
+    try:
+        fils = iter(fils)
+        while cache is not None:
+            chunk = list(itertools.islice(fils, window))
+            if not chunk:
+                return
+
+            keys = list(spread(try_coord_hash, chunk))
+            found = {}
+            try:
+                if not refresh:
+                    found = cache.get_many([key for key in keys if key])
+            except sqlite3.Error as err:
+                cache = cache_warning(err)
+            misses = [fil for fil, key in zip(chunk, keys) 
+                      if key not in found]
+            computed = dict((fil, (rots, err)) for fil, rots, err 
+                            in compute(misses))
+            try:
+                if cache is not None:
+                    cache.put_many([(key, computed[fil][0]) 
+                                    for fil, key in zip(chunk, keys)
+                                    if key and fil in computed 
+                                    and computed[fil][1] is None])
+            except sqlite3.Error as err:
+                cache = cache_warning(err)
+
+            for fil, key in zip(chunk, keys):
+                if key in found:
+                    yield fil, found[key], None
+                else:
+                    yield (fil,) + computed[fil]
+
+        for result in compute(fils):
+            yield result
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+
+
+class RotConstHandler(socketserver.StreamRequestHandler):
+    """
+    Serves get_rot_const requests over a stream socket. Each request is
+    one line of JSON, either {"path": ...} naming a coord file readable 
+    by the server or {"coord": ...} holding the text of a coord file. 
+    Each reply is one line of JSON with the keys file, rots and error, 
+    matching the output of try_rot_const.
+    """
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode())
+                if 'coord' in request:
+                    fil = request.get('name', '<coord>')
+                    try:
+                        reply = (fil, at_array_rot_const(parse_coord(
+                                     request['coord'].splitlines(), fil)),
+                                 None)
+                    except (AssertionError, KnownError) as err:
+                        reply = (fil, None, str(err))
+                else:
+                    reply = (request.get('name', request['path']),) \
+                          + try_rot_const(request['path'])[1:]
+            except (ValueError, KeyError, TypeError, AttributeError):
+                reply = (None, None, 'Malformed request: '
+                         + line.decode(errors='replace').strip())
+
+            self.wfile.write((json.dumps(dict(zip(('file', 'rots', 'error'),
+                                                   reply))) 
+                              + '\n').encode())
+            self.wfile.flush()
+
+
+class RotConstServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_rot_const(path=rot_const_client.DEFAULT_SOCKET):
+    """
+    Answer get_rot_const requests on the UNIX socket at path until 
+    interrupted, avoiding the interpreter and NumPy start-up cost per 
+    call. See RotConstHandler for the protocol and rot_const_client 
+    for a client.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    if os.path.exists(path):
+        os.remove(path)
+
+    # Shut down cleanly, removing the socket, when killed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    server = RotConstServer(path, RotConstHandler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+
+def report_rot_const(fil, rots, err, out=None):
+    """Print the result for one file to out (stdout), or its error to stderr"""
+    out = sys.stdout if out is None else out
+    if err is not None:
+        print('Error:',err,file=sys.stderr)
+        print('get_rot_const failed for file: '+ fil + '\n'
+            + 'Processing remaining files',file=sys.stderr)
+        return
+
+    axes = ['A: ','B: ','C: ']
+    print(fil + ' - ',end='',file=out)
+    for i in range(len(axes)):
+        if rots[i] > 0:
+            print(axes[i], rots[i], ' MHz ',end='',file=out)
+    print(file=out)
+
+
+class RotConstWriter(object):
+    def __init__(self, outfile=None, f_type='text', buffer=4096):
+        """
+        Write rotational constant results in one of several formats, 
+        buffering buffer records between writes. 
+
+        'text'  - The human readable lines of report_rot_const
+        'jsonl' - One JSON object per record with keys file, A, B, C, 
+                  linear, atom and error
+        'csv'   - The same fields as comma separated values with a header
+        'npy'   - A NumPy .npy file holding an M x 3 float64 array of 
+                  A, B, C. Absent moments and failed files are NaN, the
+                  errors of failed files are printed to stderr. The file
+                  names are written one per line to outfile + '.files'
+
+        Input: outfile - String with name of output file, None for stdout.
+                         Required for 'npy'. 
+               f_type  - String specifying the format
+               buffer  - Records held before each bulk write (int)
+        """
+        if f_type not in ('text', 'jsonl', 'csv', 'npy'):
+            raise KnownError('Output format ' + f_type + ' is not yet'
+                    + ' implemented.')
+        if f_type == 'npy' and outfile is None:
+            raise KnownError('The npy format needs an output file.')
+
+        self.f_type = f_type
+        self.buffer = buffer
+        self.records = []
+        self.count = 0
+
+        if f_type == 'npy':
+            self.out = open(outfile, 'wb')
+            self.names = open(outfile + '.files', 'w')
+            # Placeholder until the number of rows is known
+            self.out.write(self._npy_header(0))
+        elif outfile is None:
+            self.out = sys.stdout
+        else:
+            self.out = open(outfile, 'w')
+
+        if f_type == 'csv':
+            self.out.write('file,A,B,C,linear,atom,error\n')
+
+
+    @staticmethod
+    def _npy_header(rows):
+        """
+        Version 1.0 .npy header for a rows x 3 float64 array, padded to a
+        fixed 128 bytes so it can be rewritten in place once rows is known.
+        """
+        header = "{'descr': '<f8', 'fortran_order': False, 'shape': (%d, 3), }" \
+                 % rows
+        header = header.ljust(128 - 10 - 1) + '\n'
+        return (b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header))
+                + header.encode('latin1'))
+
+
+    def write(self, fil, rots, err):
+        """Add the result for one file, as returned by try_rot_const"""
+        if self.f_type == 'text':
+            report_rot_const(fil, rots, err, self.out)
+            return
+        if self.f_type == 'npy' and err is not None:
+            # The array has no room for the message
+            report_rot_const(fil, rots, err)
+
+        self.records.append((fil, rots, err))
+        if len(self.records) >= self.buffer:
+            self.flush()
+
+
+    def flush(self):
+        """Write out the buffered records"""
+        records, self.records = self.records, []
+        self.count += len(records)
+
+        if self.f_type == 'npy':
+            vals = np.full((len(records), 3), np.nan)
+            for row, (fil, rots, err) in zip(vals, records):
+                if err is None:
+                    row[:] = rots
+            vals[vals <= 0] = np.nan
+            self.out.write(vals.astype('<f8').tobytes())
+            self.names.writelines(fil + '\n' for fil, rots, err in records)
+            return
+
+        lines = []
+        for fil, rots, err in records:
+            vals = [None]*3 if err is not None else \
+                   [float(rot) if rot > 0 else None for rot in rots]
+            absent = vals.count(None) if err is None else 0
+            record = {'file' : fil, 'A' : vals[0], 'B' : vals[1], 
+                      'C' : vals[2], 'linear' : absent == 1, 
+                      'atom' : absent == 3, 'error' : err}
+            if self.f_type == 'jsonl':
+                lines.append(json.dumps(record) + '\n')
+            else:
+                row = io.StringIO()
+                csv.writer(row, lineterminator='\n').writerow(
+                    ['' if record[key] is None else record[key] for key
+                     in ('file', 'A', 'B', 'C', 'linear', 'atom', 'error')])
+                lines.append(row.getvalue())
+        self.out.write(''.join(lines))
+
+
+    def close(self):
+        """Flush the remaining records and close any opened files"""
+        self.flush()
+        if self.f_type == 'npy':
+            self.out.seek(0)
+            self.out.write(self._npy_header(self.count))
+            self.names.close()
+        if self.out is not sys.stdout:
+            self.out.close()
+        else:
+            self.out.flush()
+
+
+def isotopologue_records(fils, isotopes, order):
+    """
+    Results for every isotopologue of each file, with up to order atoms
+    substituted by isotopes. The substitutions are appended to the file
+    name in brackets. (Type: generator of (fil, rots, err))
+    """
+    for fil in fils:
+        # Assume error local to a single file
+        try:
+            at_array = read_coord(fil)
+            assert len(at_array) != 0, \
+                'No atoms found in '+fil+', check coord file'
+            labels = [entry[3] for entry in at_array]
+            patterns, masses = isotopologue_masses(labels, isotopes, order)
+            vals = isotopologue_rot_const(
+                    [entry[0:3] for entry in at_array], masses)
+        except (AssertionError, KnownError) as err:
+            yield fil, None, str(err)
+            continue
+        for pattern, rots in zip(patterns, vals):
+            name = ','.join(isotope+str(i+1) for i, isotope in pattern)
+            yield fil+' ['+name+']', rots, None
+
+
+def trajectory_records(fils, f_type=None):
+    """
+    Results for every frame of each trajectory, with the frame index 
+    appended to the file name in brackets. 
+    (Type: generator of (fil, rots, err))
+    """
+    for fil in fils:
+        # Assume error local to a single trajectory
+        try:
+            for i, rots in enumerate(stream_rot_const(fil, f_type)):
+                yield fil+'['+str(i)+']', rots, None
+        except (AssertionError, KnownError) as err:
+            yield fil, None, str(err)
 
 
 if __name__ == '__main__':
@@ -205,22 +1128,107 @@ if __name__ == '__main__':
             + ' Turbomole format coord files and returns the rotational'
             + ' constants associated with the molecules specified therein.'
             + ' (in MHz)')
-    parser.add_argument('coords', nargs='*', default=['coord'], help='A'
-            + ' list of paths to Turbomole format coord files.'
-            + ' (Default: ./coord)')
+    parser.add_argument('coords', nargs='*', help='A list of paths to'
+            + ' Turbomole format coord files. (Default: ./coord, unless'
+            + ' --recursive is given)')
+    parser.add_argument('-R', '--recursive', action='append', default=[],
+            metavar='ROOT', help='Also process every file called NAME'
+            + ' below ROOT, starting on each as soon as it is found. May be'
+            + ' repeated.')
+    parser.add_argument('-n', '--name', default='coord', help='File name'
+            + ' searched for by --recursive, may hold shell wildcards.'
+            + ' (Default: coord)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number'
+            + ' of worker processes the files are spread over. Output'
+            + ' stays in input order. (Default: 1)')
+    parser.add_argument('--cache', default=rot_cache.DEFAULT_PATH, help='Path'
+            + ' to the SQLite file caching results by $coord block, created'
+            + ' on first use unless --no-cache is given.'
+            + ' (Default: '+rot_cache.DEFAULT_PATH+')')
+    parser.add_argument('--cache-size', type=int, default=10**6, help='Max'
+            + ' number of entries kept in the cache. (Default: 1000000)')
+    parser.add_argument('--no-cache', action='store_true', help='Neither'
+            + ' read nor write the cache.')
+    parser.add_argument('--refresh', action='store_true', help='Recompute'
+            + ' every file, overwriting its cached result.')
+    parser.add_argument('-t', '--trajectory', action='store_true', help='Treat'
+            + ' each file as a trajectory (gradient, mdlog or multi-frame'
+            + ' xyz) and print the constants of every frame. Not cached and'
+            + ' not spread over --jobs.')
+    parser.add_argument('--traj-format', default=None, choices=['gradient',
+            'mdlog', 'xyz', 'coord'], help='Trajectory file type.'
+            + ' (Default: guessed from the file)')
+    parser.add_argument('-i', '--isotopologues', type=int, default=0,
+            metavar='ORDER', help='Also print the constants of every'
+            + ' isotopologue with up to ORDER substituted atoms. Not cached'
+            + ' and not spread over --jobs.')
+    parser.add_argument('--isotopes', default='13c,d,15n,18o', help='Comma'
+            + ' separated isotopes substituted by --isotopologues.'
+            + ' (Default: 13c,d,15n,18o)')
+    parser.add_argument('--serve', nargs='?', const=rot_const_client.
+            DEFAULT_SOCKET, metavar='SOCKET', help='Instead of processing'
+            + ' files, answer requests from rot_const_client on a UNIX'
+            + ' socket. (Default socket: '+rot_const_client.DEFAULT_SOCKET
+            + ')')
+    parser.add_argument('-f', '--format', default='text', choices=['text',
+            'jsonl', 'csv', 'npy'], help='Output format. npy writes a float64'
+            + ' array of A, B, C with NaN for absent values and failed'
+            + ' files, whose errors go to stderr, and the file names to'
+            + ' OUTPUT.files. (Default: text)')
+    parser.add_argument('-o', '--output', default=None, help='File the'
+            + ' results are written to. (Default: stdout)')
     args = parser.parse_args()
 
-    for fil in args.coords: 
-        # Assume error local to a single file
-        try:
-            rots = get_rot_const(fil)
-            axes = ['A: ','B: ','C: ']
-            print(fil + ' - ',end='')
-            for i in range(len(axes)):
-                if rots[i] > 0:
-                    print(axes[i], rots[i], ' MHz ',end='')
-            print()
-        except (AssertionError, KnownError) as err:
-            print('Error:',err,file=sys.stderr)
-            print('get_rot_const failed for file: '+ fil + '\n'
-                + 'Processing remaining files',file=sys.stderr)
+    if args.trajectory or args.isotopologues > 0:
+        ignored = [option for option, given in 
+                   [('--jobs', args.jobs != 1), ('--refresh', args.refresh),
+                    ('--cache', args.cache != rot_cache.DEFAULT_PATH),
+                    ('--cache-size', args.cache_size != 10**6)] if given]
+        if ignored:
+            parser.error(', '.join(ignored) + ' cannot be used with'
+                    + ' --trajectory or --isotopologues')
+
+    if args.serve:
+        serve_rot_const(args.serve)
+        sys.exit(0)
+
+    try:
+        writer = RotConstWriter(args.output, args.format)
+    except KnownError as err:
+        parser.error(str(err))
+
+    fils = args.coords
+    if not fils and not args.recursive:
+        fils = ['coord']
+    fils = itertools.chain(fils, *[crawl_coords(root, args.name) 
+                                   for root in args.recursive])
+
+    cache = None
+    try:
+        if args.isotopologues > 0:
+            records = isotopologue_records(fils, 
+                                           args.isotopes.split(','),
+                                           args.isotopologues)
+        elif args.trajectory:
+            records = trajectory_records(fils, args.traj_format)
+        else:
+            if not args.no_cache:
+                # The cache must never stop a run
+                try:
+                    cache = rot_cache.RotConstCache(args.cache,
+                                                    args.cache_size)
+                except (OSError, sqlite3.Error) as err:
+                    cache_warning(err)
+            # Assume error local to a single file
+            records = map_rot_const(fils, args.jobs, cache,
+                                    args.refresh)
+
+        for fil, rots, err in records:
+            writer.write(fil, rots, err)
+    finally:
+        writer.close()
+        if cache is not None:
+            try:
+                cache.close()
+            except sqlite3.Error as err:
+                cache_warning(err)
@@ -0,0 +1,106 @@
+"""
+Persistent cache of rotational constants used by get_rot_const.
+
+Results are stored in a local SQLite file keyed by a hash of the $coord
+block they were computed from, so repeated sweeps over unchanged
+geometries skip the parse and eigen-decomposition. The cache is bounded
+in size, the least recently used entries are evicted first.
+"""
+
+import os
+import sqlite3
+import time
+
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache',
+                            'get_rot_const.sqlite')
+
+
+class RotConstCache(object):
+    def __init__(self, path=DEFAULT_PATH, max_entries=10**6):
+        """
+        Open (creating if needed) the cache stored at path. Raises 
+        OSError or sqlite3.Error if it cannot be opened.
+
+        Input: path        - String with path to the SQLite cache file
+               max_entries - Entries kept after evict is called (int)
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path)
+        try:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS rot_const ('
+                              ' key TEXT PRIMARY KEY,'
+                              ' a REAL, b REAL, c REAL,'
+                              ' used REAL)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS rot_const_used'
+                              ' ON rot_const (used)')
+        except sqlite3.Error:
+            # Not a usable database, e.g. corrupt or locked
+            self.conn.close()
+            raise
+
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM rot_const').fetchone()[0]
+
+
+    def get_many(self, keys):
+        """
+        Look up a batch of keys, marking the ones found as recently used.
+
+        Input: keys - Hashes of $coord blocks (iterable of String)
+
+        Output: found - Dictionary of key to list of the three rotational
+                        constants, for the keys present in the cache
+        """
+        keys = list(set(keys))
+        found = {}
+        # SQLite limits the number of bound parameters per statement
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i+500]
+            rows = self.conn.execute('SELECT key, a, b, c FROM rot_const'
+                                     ' WHERE key IN ('
+                                     + ','.join('?'*len(chunk)) + ')', chunk)
+            for key, a, b, c in rows:
+                found[key] = [a, b, c]
+
+        now = time.time()
+        self.conn.executemany('UPDATE rot_const SET used = ? WHERE key = ?',
+                              [(now, key) for key in found])
+        self.conn.commit()
+        return found
+
+
+    def put_many(self, items):
+        """
+        Store a batch of results, replacing any existing entries.
+
+        Input: items - Pairs of key and the three rotational constants
+                       (iterable of tuple)
+        """
+        now = time.time()
+        self.conn.executemany('INSERT OR REPLACE INTO rot_const'
+                              ' (key, a, b, c, used) VALUES (?, ?, ?, ?, ?)',
+                              [(key, rots[0], rots[1], rots[2], now)
+                               for key, rots in items])
+        self.conn.commit()
+
+
+    def evict(self):
+        """Drop the least recently used entries beyond max_entries"""
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            self.conn.execute('DELETE FROM rot_const WHERE key IN'
+                              ' (SELECT key FROM rot_const'
+                              '  ORDER BY used LIMIT ?)', (excess,))
+            self.conn.commit()
+
+
+    def close(self):
+        self.evict()
+        self.conn.close()
@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+
+"""
+Thin client for a get_rot_const server.
+
+Sends coord file paths, or the text of a coord file read from stdin, to
+a server started with 'get_rot_const.py --serve' and prints the returned
+rotational constants in the same format as get_rot_const. Only the
+standard library is imported, so a call costs little more than the
+interpreter start-up. If no server is listening the constants are
+computed in-process instead.
+"""
+
+import os
+import sys
+import json
+import socket
+import argparse
+
+
+DEFAULT_SOCKET = os.path.join(os.path.expanduser('~'), '.cache',
+                              'get_rot_const.sock')
+
+
+def connect(path=DEFAULT_SOCKET):
+    """Return a socket connected to the server at path, or None"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (IOError, OSError):
+        sock.close()
+        return None
+    return sock
+
+
+def request_rot_const(requests, path=DEFAULT_SOCKET):
+    """
+    Yield the server's reply to each request, in order. Falls back to
+    computing the constants in-process if no server is listening.
+
+    Input: requests - Dictionaries holding either 'path' (path to a coord
+                      file) or 'coord' (text of a coord file) and
+                      optionally 'name' (iterable of dict)
+           path     - String with path to the server socket
+
+    Output: Generator of (fil, rots, err) tuples as returned by
+            get_rot_const.try_rot_const
+    """
+    sock = connect(path)
+    if sock is None:
+        for reply in _local_rot_const(requests):
+            yield reply
+        return
+
+    with sock:
+        replies = sock.makefile('rb')
+        for request in requests:
+            sock.sendall((json.dumps(request) + '\n').encode())
+            reply = json.loads(replies.readline().decode())
+            yield reply['file'], reply['rots'], reply['error']
+
+
+def _local_rot_const(requests):
+    """In-process equivalent of the server, see request_rot_const"""
+    import get_rot_const as grc
+
+    for request in requests:
+        if 'coord' in request:
+            fil = request.get('name', '<coord>')
+            try:
+                yield fil, grc.at_array_rot_const(grc.parse_coord(
+                           request['coord'].splitlines(), fil)), None
+            except (AssertionError, grc.KnownError) as err:
+                yield fil, None, str(err)
+        else:
+            fil, rots, err = grc.try_rot_const(request['path'])
+            yield request.get('name', fil), rots, err
+
+
+def report_rot_const(fil, rots, err):
+    """
+    Print the result for one file, or its error to stderr. Same output
+    as get_rot_const.report_rot_const, repeated here so the client does
+    not need to import NumPy.
+    """
+    if err is not None:
+        print('Error:',err,file=sys.stderr)
+        print('get_rot_const failed for file: '+ fil + '\n'
+            + 'Processing remaining files',file=sys.stderr)
+        return
+
+    axes = ['A: ','B: ','C: ']
+    print(fil + ' - ',end='')
+    for i in range(len(axes)):
+        if rots[i] > 0:
+            print(axes[i], rots[i], ' MHz ',end='')
+    print()
+
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description='Takes as argument a list of'
+            + ' Turbomole format coord files and returns the rotational'
+            + ' constants associated with the molecules specified therein'
+            + ' (in MHz), asking a running get_rot_const server when there'
+            + ' is one. A path of - reads the text of a coord file from'
+            + ' stdin and sends it to the server as is.')
+    parser.add_argument('coords', nargs='*', default=['coord'], help='A'
+            + ' list of paths to Turbomole format coord files.'
+            + ' (Default: ./coord)')
+    parser.add_argument('-s', '--socket', default=DEFAULT_SOCKET, help='Path'
+            + ' to the server socket. (Default: '+DEFAULT_SOCKET+')')
+    args = parser.parse_args()
+
+    # Paths are resolved here since the server may have another
+    # working directory
+    requests = ({'coord' : sys.stdin.read(), 'name' : '-'} if fil == '-'
+                else {'path' : os.path.abspath(fil), 'name' : fil}
+                for fil in args.coords)
+    for fil, rots, err in request_rot_const(requests, args.socket):
+        report_rot_const(fil, rots, err)
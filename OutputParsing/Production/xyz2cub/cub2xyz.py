@@ -0,0 +1,54 @@
+#! /usr/bin/env python
+
+import re
+import argparse
+
+import numpy as np
+
+import xyz2cub
+
+#cub2xyz - The reverse of xyz2cub. Takes a cube file, gzipped cube file,
+#          raw volume from xyz2cub -f vol32/vol64 or Turbomole binary 
+#          plt file and writes its grid as a Turbomole style xyz file, 
+#          one point per line with its coordinates followed by its 
+#          value. Points are listed in cube order with a blank line 
+#          after each row of vector 1, so xyz2cub converts the file 
+#          straight back. The cube is read a plane at a time with 
+#          CubReader, however large it is. The output file will be the
+#          input file's basename followed by .xyz.
+
+def cub2xyz(cubnames):
+    for cubname in cubnames:
+        xyzname = re.sub(r'\.([cC][uU][bB](\.gz)?|vol|[pP][lL][tT])$','',cubname)+'.xyz'
+        with xyz2cub.CubReader(cubname) as reader, open(xyzname,'w') as xyz:
+            writeXyzGrid(reader, xyz)
+
+
+#writeXyzGrid - Writes every point of a cube as an xyz file line, a
+#               plane of vector 3 at a time.
+#
+#   input:  reader - The CubReader of the cube
+#              xyz - The opened xyz file for writing to
+
+def writeXyzGrid(reader,xyz):
+    n3, n2, n1 = reader.shape
+    rowFmt = (' %15.10f %15.10f %15.10f %16.8e\n'*n1) + '\n'
+    for i3 in range(n3):
+        pts = xyz2cub.gridPoints(reader.header, i3*n2*n1, n2*n1)
+        block = np.column_stack((pts, reader[i3].ravel()))
+        xyz.write((rowFmt*n2) % tuple(block.ravel().tolist()))
+
+
+if __name__ == '__main__' :
+    parser = argparse.ArgumentParser(description='The reverse of xyz2cub. Takes as input cube '+
+            'files, gzipped cube files or raw volumes written by xyz2cub and writes each as a '+
+            'Turbomole style xyz file, grid point coordinates followed by the property value. '+
+            "The output file will be the input file's basename followed by .xyz")
+
+    parser.add_argument('cubName',nargs='+', help='The names of the .cub, .cub.gz, .vol or .plt '+
+                        'files that need to be converted.')
+
+    args = parser.parse_args()
+
+
+    cub2xyz(args.cubName)
@@ -0,0 +1,250 @@
+#! /usr/bin/env python
+
+import re
+import ast
+import sys
+import argparse
+
+import numpy as np
+
+import xyz2cub
+
+#Functions that may be used in an expression besides + - * / **
+FUNCTIONS = {'abs' : np.abs, 'sqrt' : np.sqrt, 'exp' : np.exp, 'log' : np.log,
+             'minimum' : np.minimum, 'maximum' : np.maximum}
+
+#Names the cubes are given in an expression, in the order listed
+NAMES = 'abcdefghijklmnopqrstuvwxyz'
+
+#cubcalc - Evaluates an arithmetic expression over cube files, e.g.
+#          'a - b - c' for a density difference or '2*a' to rescale,
+#          where a is the first cube given, b the second and so on. The
+#          cubes must share a grid. They are read a plane at a time, so
+#          memory use does not depend on their size. The result can be
+#          written as a cube, gzipped cube or raw volume, and the same
+#          pass gives its integral over the grid, its minimum and
+#          maximum and a histogram.
+#
+#   input:  expr - The expression (string)
+#       cubnames - Paths to the cube files (list of string)
+#        outname - Path the result is written to, or None (string)
+#            fmt - One of xyz2cub.OUTPUT_FORMATS, or None to go by the
+#                  extension of outname
+#           bins - Number of histogram bins, or None for no histogram
+#      histRange - Lowest and highest histogram edge, or None for the
+#                  minimum and maximum, which takes a second pass
+#
+#   return: stats - The CubStats of the result
+
+def cubcalc(expr,cubnames,outname=None,fmt=None,bins=None,histRange=None):
+    func = compileExpr(expr, NAMES[:len(cubnames)])
+
+    readers = []
+    try:
+        for cubname in cubnames:
+            readers.append(xyz2cub.CubReader(cubname))
+        header = checkGrids(readers)
+        if bins and histRange is None:
+            stats = evalPlanes(func, readers, CubStats(header))
+            histRange = (stats.min, stats.max)
+
+        out = None
+        if outname is not None:
+            fmt = fmt or outputFormat(outname)
+            base = outname[:len(outname)-len(xyz2cub.OUTPUT_FORMATS[fmt][0])] \
+                   if outname.endswith(xyz2cub.OUTPUT_FORMATS[fmt][0]) else outname
+            out = xyz2cub.openOutput(base, fmt, header['atoms'], header['atNum'])
+        try:
+            stats = evalPlanes(func, readers, CubStats(header, bins, histRange),
+                               out)
+        finally:
+            if out is not None:
+                out.close()
+    finally:
+        for reader in readers:
+            reader.close()
+    return stats
+
+
+#compileExpr - Checks an expression only uses numbers, the given names,
+#              arithmetic and FUNCTIONS, and compiles it.
+#
+#   input:  expr - The expression (string)
+#          names - Names that may be used (string or list)
+#
+#   return: A function taking the names as keyword arguments
+
+def compileExpr(expr,names):
+    try:
+        tree = ast.parse(expr.strip(), mode='eval')
+    except SyntaxError as err:
+        raise ValueError('Could not parse the expression '+expr+': '+str(err))
+
+    allowed = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Load,
+               ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if node.id not in names and node.id not in FUNCTIONS:
+                raise ValueError('Unknown name '+node.id+' in the expression, the '+
+                                 'cubes given are named '+', '.join(names))
+        elif isinstance(node, ast.Constant):
+            if not isinstance(node.value, (int, float)):
+                raise ValueError('Only numbers may be used as constants')
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS \
+                    or node.keywords:
+                raise ValueError('Only '+', '.join(sorted(FUNCTIONS))+
+                                 ' may be called in an expression')
+        elif not isinstance(node, allowed):
+            raise ValueError('Not allowed in an expression: '+expr)
+
+    code = compile(tree, '<expression>', 'eval')
+    def func(**planes):
+        planes.update(FUNCTIONS)
+        return eval(code, {'__builtins__' : {}}, planes)
+    return func
+
+
+#checkGrids - Makes sure cubes share one grid, within the precision the
+#             grid is written with
+#
+#   input:  readers - The CubReaders of the cubes
+#
+#   return: The header of the first cube (dict)
+
+def checkGrids(readers,tol=1e-6):
+    header = readers[0].header
+    for reader in readers[1:]:
+        other = reader.header
+        if list(other['points']) != list(header['points']) \
+                or not np.allclose(other['origin'], header['origin'], atol=tol) \
+                or not np.allclose(other['incs'], header['incs'], atol=tol):
+            raise ValueError('The grid of '+reader.name+' differs from that of '+
+                             readers[0].name)
+    return header
+
+
+#outputFormat - Works out the output format from a file name
+#
+#   input:  outname - Path of the output (string)
+#
+#   return: One of xyz2cub.OUTPUT_FORMATS
+
+def outputFormat(outname):
+    if re.search(r'\.cub\.gz$', outname, re.IGNORECASE):
+        return 'cub.gz'
+    if outname.endswith('.vol'):
+        return 'vol64'
+    return 'cub'
+
+
+#evalPlanes - Evaluates the expression one plane of vector 3 at a time
+#
+#   input:  func - The compiled expression, from compileExpr
+#        readers - The CubReaders of the cubes
+#          stats - The CubStats the result is added to
+#            out - Output to write the result to, or None
+#
+#   return: stats
+
+def evalPlanes(func,readers,stats,out=None):
+    n3, n2, n1 = readers[0].shape
+    writer = out.begin(readers[0].header, n2) if out is not None else None
+    planes = zip(*[reader.iterPlanes() for reader in readers])
+    for plane in planes:
+        vals = func(**dict(zip(NAMES, plane)))
+        vals = np.broadcast_to(np.asarray(vals, dtype=np.float64), (n2, n1))
+        stats.add(vals)
+        if writer is not None:
+            writer.write(vals.ravel())
+    if writer is not None:
+        writer.close()
+    return stats
+
+
+#CubStats - Reductions of the values of a grid, added a block at a time.
+#           The integral is the sum of the values times the volume of a
+#           grid cell.
+#
+#   input:  grid - The grid as returned by inferGrid
+#           bins - Number of histogram bins, or None
+#      histRange - Lowest and highest histogram edge
+
+class CubStats(object):
+    def __init__(self,grid,bins=None,histRange=None):
+        self.cellVolume = abs(np.linalg.det(np.array(grid['incs'])))
+        self.count = 0
+        self.total = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.edges = None
+        if bins:
+            lo, hi = histRange
+            if hi <= lo:
+                hi = lo + 1.0
+            self.edges = np.linspace(lo, hi, bins+1)
+            self.hist = np.zeros(bins, dtype=np.int64)
+
+    def add(self,vals):
+        self.count += vals.size
+        self.total += vals.sum()
+        self.min = min(self.min, vals.min())
+        self.max = max(self.max, vals.max())
+        if self.edges is not None:
+            self.hist += np.histogram(vals, self.edges)[0]
+
+    def integral(self):
+        return self.total*self.cellVolume
+
+    #report - Prints the reductions
+    def report(self):
+        print('Points:   ' + str(self.count))
+        print('Integral: ' + repr(float(self.integral())))
+        print('Min:      ' + repr(float(self.min)))
+        print('Max:      ' + repr(float(self.max)))
+        if self.edges is not None:
+            print('Histogram:')
+            for lo, hi, count in zip(self.edges[:-1], self.edges[1:], self.hist):
+                print('%14.6e %14.6e %12d' % (lo, hi, count))
+
+
+if __name__ == '__main__' :
+    parser = argparse.ArgumentParser(description='Evaluates an arithmetic expression over '+
+            'cube files sharing a grid, e.g. "a - b - c" for a density difference or "2*a" '+
+            'to rescale, where a is the first cube given, b the second and so on. Besides '+
+            '+ - * / ** the functions '+', '.join(sorted(FUNCTIONS))+' may be used. The '+
+            'cubes are read a plane at a time, so memory use does not depend on their size. '+
+            'Prints the integral, minimum and maximum of the result and optionally writes it '+
+            'and a histogram.')
+
+    parser.add_argument('expr',help='The expression to evaluate.')
+
+    parser.add_argument('cubName',nargs='+',help='The .cub, .cub.gz or .vol files, named a, '+
+                        'b, c and so on in the order given.')
+
+    parser.add_argument('-o','--output',default=None,help='File the result is written to. '+
+                        'Its format goes by the extension, .cub, .cub.gz or .vol for a '+
+                        'float64 volume, unless --format is given.')
+
+    parser.add_argument('-f','--format',default=None,choices=sorted(xyz2cub.OUTPUT_FORMATS),
+                        help='Format of the output file.')
+
+    parser.add_argument('--hist',type=int,default=None,metavar='BINS',help='Also print a '+
+                        'histogram of the result with this many bins.')
+
+    parser.add_argument('--range',type=float,nargs=2,default=None,metavar=('LO','HI'),
+                        help='Range of the histogram. (Default: the minimum and maximum, '+
+                        'which reads the cubes twice)')
+
+    args = parser.parse_args()
+
+    if len(args.cubName) > len(NAMES):
+        parser.error('At most '+str(len(NAMES))+' cubes can be given')
+
+    try:
+        stats = cubcalc(args.expr, args.cubName, args.output, args.format, args.hist,
+                        args.range)
+    except (IOError, ValueError) as err:
+        print('Error: '+str(err), file=sys.stderr)
+        sys.exit(1)
+    stats.report()
@@ -0,0 +1,182 @@
+#! /usr/bin/env python
+
+import sys
+import argparse
+
+import numpy as np
+
+import xyz2cub
+
+#Query points interpolated at once, bounds the size of the stencils
+BATCH_POINTS = 65536
+
+#cubinterp - Evaluates the property held in a cube file at arbitrary
+#            points by trilinear or tricubic (Catmull-Rom)
+#            interpolation, e.g. the ESP at the atoms or at molecular
+#            surface points without another $pointval run. Only the
+#            part of the grid around the points is read. Points outside
+#            the grid are given fill. In the outermost cells the 
+#            tricubic stencil reaches one point past the edge, which is
+#            extrapolated linearly from the last two, so linear fields
+#            are still reproduced exactly there.
+#
+#   input:  cubname - Path to a .cub, .cub.gz or .vol file (string)
+#               pts - Query points in bohr (M x 3 array-like)
+#             order - 1 for trilinear, 3 for tricubic (int)
+#              fill - Value given to points outside the grid (float)
+#
+#   return: The interpolated values (M numpy array)
+
+def cubinterp(cubname,pts,order=1,fill=np.nan):
+    pts = np.asarray(pts, dtype=np.float64).reshape(-1, 3)
+    with xyz2cub.CubReader(cubname) as reader:
+        frac = fracIndices(reader.header, pts)
+        inside = insideGrid(frac, reader.shape)
+        vals = np.full(len(pts), fill, dtype=np.float64)
+        if not inside.any():
+            return vals
+
+        #Read only the sub-volume the stencils reach
+        reach = 1 if order == 1 else 2
+        lo = np.maximum(np.floor(frac[inside].min(axis=0)).astype(np.intp) - reach + 1, 0)
+        hi = np.minimum(np.floor(frac[inside].max(axis=0)).astype(np.intp) + reach + 1,
+                        reader.shape)
+        sub = reader[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+
+    vals[inside] = interpolateGrid(sub, frac[inside] - lo, order)
+    return vals
+
+
+#fracIndices - Position of points in units of the grid vectors, so
+#              grid point (i3, i2, i1) is at (i3, i2, i1)
+#
+#   input:  grid - The grid as returned by inferGrid
+#            pts - Points in bohr (M x 3 numpy array)
+#
+#   return: Fractional indices along vectors 3, 2, 1 (M x 3 numpy array)
+
+def fracIndices(grid,pts):
+    incs = np.array(grid['incs'], dtype=np.float64)
+    return np.linalg.solve(incs.T, (pts - np.asarray(grid['origin'])).T).T
+
+
+#insideGrid - Which fractional indices lie on or within the grid
+#
+#   input:  frac - As returned by fracIndices
+#          shape - Points along vectors 3, 2, 1 (tuple)
+#
+#   return: Mask of the points inside (M numpy array of bool)
+
+def insideGrid(frac,shape,tol=1e-6):
+    top = np.array(shape) - 1
+    return ((frac >= -tol) & (frac <= top + tol)).all(axis=1)
+
+
+#stencil - Indices and weights along one vector for each point. A cubic
+#          stencil running off the grid uses f[-1] = 2f[0] - f[1] and
+#          f[n] = 2f[n-1] - f[n-2], folded into the weights of the
+#          points inside.
+#
+#   input:  f - Fractional indices along the vector (M numpy array)
+#           n - Points along the vector (int)
+#       order - 1 for linear, 3 for cubic (int)
+#
+#   return: idx     - Indices of the stencil (M x order+1 numpy array)
+#           weights - Their weights (M x order+1 numpy array)
+
+def stencil(f,n,order):
+    base = np.clip(np.floor(f).astype(np.intp), 0, max(n-2, 0))
+    t = np.clip(f - base, 0.0, 1.0)[:, None]
+    if order == 1:
+        idx = base[:, None] + np.arange(2)
+        weights = np.hstack((1.0 - t, t))
+    else:
+        idx = base[:, None] + np.arange(-1, 3)
+        t2, t3 = t*t, t*t*t
+        weights = 0.5*np.hstack((-t3 + 2*t2 - t, 3*t3 - 5*t2 + 2,
+                                 -3*t3 + 4*t2 + t, t3 - t2))
+        if n >= 2:
+            low = base == 0
+            weights[low, 1] += 2*weights[low, 0]
+            weights[low, 2] -= weights[low, 0]
+            weights[low, 0] = 0.0
+            high = base == n-2
+            weights[high, 2] += 2*weights[high, 3]
+            weights[high, 1] -= weights[high, 3]
+            weights[high, 3] = 0.0
+    return np.clip(idx, 0, n-1), weights
+
+
+#interpolateGrid - Interpolates grid values at fractional indices
+#
+#   input:  vals - Values on the grid (n3 x n2 x n1 numpy array)
+#           frac - Fractional indices within the grid (M x 3 numpy array)
+#          order - 1 for trilinear, 3 for tricubic (int)
+#
+#   return: The interpolated values (M numpy array)
+
+def interpolateGrid(vals,frac,order=1):
+    if order not in (1, 3):
+        raise ValueError('Interpolation order must be 1 or 3')
+
+    out = np.empty(len(frac))
+    for start in range(0, len(frac), BATCH_POINTS):
+        f = frac[start:start+BATCH_POINTS]
+        (i3, w3), (i2, w2), (i1, w1) = [stencil(f[:, k], vals.shape[k], order)
+                                        for k in range(3)]
+        corners = vals[i3[:, :, None, None], i2[:, None, :, None], i1[:, None, None, :]]
+        out[start:start+BATCH_POINTS] = np.einsum('ma,mb,mc,mabc->m', w3, w2, w1, corners)
+    return out
+
+
+#readPoints - Reads query points from a text file, the first three
+#             columns of each line in bohr. Blank lines and comments
+#             starting with # are skipped.
+#
+#   input:  name - Path to the file (string)
+#
+#   return: Points (M x 3 numpy array)
+
+def readPoints(name):
+    return np.loadtxt(name, comments='#', usecols=(0, 1, 2), ndmin=2)
+
+
+if __name__ == '__main__' :
+    parser = argparse.ArgumentParser(description='Evaluates the property held in a cube file '+
+            'at arbitrary points by trilinear or tricubic interpolation, e.g. the ESP at the '+
+            'atoms or at molecular surface points. Prints each point followed by its value. '+
+            'Points outside the grid are given nan.')
+
+    parser.add_argument('cubName',help='The .cub, .cub.gz or .vol file to interpolate.')
+
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('-p','--points',default=None,help='Text file of query points, x y z '+
+                        'in bohr on each line.')
+
+    source.add_argument('-c','--coord',default=None,help='Turbomole coordinate file whose '+
+                        'atoms are the query points. (Default: the atoms in the cube file)')
+
+    parser.add_argument('--cubic',action='store_true',help='Interpolate tricubically rather '+
+                        'than trilinearly.')
+
+    parser.add_argument('-o','--output',default=None,help='File the values are written to. '+
+                        '(Default: standard output)')
+
+    args = parser.parse_args()
+
+    if args.points:
+        pts = readPoints(args.points)
+    elif args.coord:
+        with open(args.coord,'r') as coordfile:
+            pts = xyz2cub.atomCoords(xyz2cub.formatAtCoords(coordfile)[0])
+    else:
+        with xyz2cub.CubReader(args.cubName) as reader:
+            pts = xyz2cub.atomCoords(reader.header['atoms'])
+
+    vals = cubinterp(args.cubName, pts, 3 if args.cubic else 1)
+
+    out = open(args.output,'w') if args.output else sys.stdout
+    block = np.column_stack((pts, vals))
+    out.write((' %15.10f %15.10f %15.10f %16.8e\n'*len(block)) % tuple(block.ravel().tolist()))
+    if args.output:
+        out.close()
@@ -1,9 +1,38 @@
-#! /usr/bin/python
+#! /usr/bin/env python
 
-from subprocess           import call, Popen, PIPE
 import re
+import os
 import sys
 import argparse
+import itertools
+import tempfile
+import gzip
+import io
+import json
+import collections
+import multiprocessing
+
+import numpy as np
+
+#The shared periodic table lives in Common/ at the top of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', '..', 'Common'))
+import elements
+
+#Rough peak memory used per point of a chunk while converting, from the
+#text lines, the parsed array, the grid check and the formatted output
+BYTES_PER_POINT = 512
+
+#Output formats, the extension added to the xyz file's basename and the
+#type of a raw volume, or None for a cube file
+OUTPUT_FORMATS = {'cub' : ('.cub', None), 'cub.gz' : ('.cub.gz', None),
+                  'vol32' : ('.vol', '<f4'), 'vol64' : ('.vol', '<f8')}
+GZIP_LEVEL = 6
+VOLUME_VERSION = 1
+
+#gOpenMol plt files, as written by Turbomole, give the grid in angstrom
+ANG_2_BOHR = 1.889725989
+PLT_HEADER_BYTES = 44
 
 #xyz2cub - This program takes as input a Turbomole xyz file (with grid 
 #          point coordinates followed by property values) and converts 
@@ -11,86 +40,196 @@ import argparse
 #          same as a coordinate xyz files. 
 #
 #          It does this by looking at the number of entries and the 
-#          distance apart they are. It relies on the fact values start
-#          at the gridpoint with the smallest possible coordinates and 
-#          the file iterates along x, y, z in that order. Each y/z
-#          increment must be marked by a newline. The output file will 
-#          be the input xyz file's basename followed by .cub
-def xyz2cub (xyzname,coord):
-    xyzname=xyzname[0]
-    xyz_end=re.compile('\.[xX][yY][zZ]$')
-
-    #coord file must be in the current directory
-    coordfile=open(coord,'r')
-
-
-    #Requires the file name to end in xyz, asks for name again if
-    #not. 
-#    if not xyz_end.search(xyzname) :
-#        bad_input=True
-#        while bad_input :
-#            xyzname=raw_input("File name must end in '.xyz'"+ \
-#                    " please re-enter (q to quit): ")
-#            if xyzname == 'q':
-#                sys.exit(1)
-#            elif xyz_end.search(xyzname) :
-#                bad_input=False
+#          distance apart they are. The points may be listed in any 
+#          order, the cube always iterates along x, y, z in that order.
+#          Blank lines between blocks are allowed but not needed. The 
+#          output file will be the input xyz file's basename followed 
+#          by .cub. If each point holds several values one cube is 
+#          written per value, named _1, _2 and so on. Turbomole binary 
+#          .plt grids are converted directly, see readPlt. The xyz file
+#          is converted in chunks so no more than about memory MB is 
+#          used however large the grid is. 
+#
+#          Any number of xyz files may be given, all sharing the coord
+#          file, which is only read once. With jobs > 1 several files 
+#          are converted at once, or for a single file its values are 
+#          formatted in that many processes. A file that fails to 
+#          convert is reported and the remaining files are converted.
+#
+#          fmt picks the output, a cube file, a gzipped cube file or a 
+#          raw volume, see OUTPUT_FORMATS and openOutput. 
+#
+#          region, if given, crops and downsamples the grid as it is 
+#          converted, see RegionWriter. Its 'box' may be left out and 
+#          'around' (atom numbers counting from 1) and 'pad' given 
+#          instead, to crop to the atoms plus pad bohr on each side.
+def xyz2cub (xyznames,coord,memory=256,jobs=1,fmt='cub',region=None):
+    with open(coord,'r') as coordfile:
+        atoms, atNum = formatAtCoords(coordfile)
 
+    if region is not None and region.get('around'):
+        region = dict(region)
+        region['box'] = atomBox(atoms, region.pop('around'), region.pop('pad', 0.0))
+
+    #The memory budget is shared between the processes
+    jobs = max(1, jobs)
+    chunkPoints = max(1024, memory*2**20//(BYTES_PER_POINT*jobs))
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+
+    try:
+        if pool is not None and len(xyznames) > 1:
+            tasks = ((xyzname, atoms, atNum, chunkPoints, fmt, None, region) 
+                     for xyzname in xyznames)
+            results = pool.imap(convertXyzTask, tasks)
+        else:
+            results = (convertXyzTask((xyzname, atoms, atNum, chunkPoints, fmt, pool, region,
+                                       jobs))
+                       for xyzname in xyznames)
+
+        failed = 0
+        for xyzname, err in results:
+            if err is not None:
+                failed += 1
+                print('Error: '+err, file=sys.stderr)
+                print('xyz2cub failed for file: '+xyzname, file=sys.stderr)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if failed:
+        sys.exit(1)
+
+
+#getCubName - The output file name for an xyz file, its basename 
+#             followed by ext
+#
+#   input:  xyzname - Path to the xyz file (string)
+#               ext - Extension of the output (string)
+#
+#   return: Path to the output file (string)
+
+def getCubName(xyzname,ext='.cub'):
     #I don't put .cub in the sub field in case file
     #does not end in .xyz
-    cubname=str(re.sub(xyz_end,'',xyzname))+'.cub'
+    return str(re.sub(r'\.([xX][yY][zZ]|[pP][lL][tT])$','',xyzname))+ext
 
-    #opening the two files to prepare for conversion
-    cubfile=open(cubname,'w')
-    xyzfile=open(xyzname,'r')
 
-    atNum = writeAtCoords(coordfile,cubfile)
-    printCubVals(xyzfile,cubfile,atNum)
+#convertXyzFile - Converts one xyz file to a cube file next to it, 
+#                 using an atom section already formatted by 
+#                 formatAtCoords. An xyz file with N > 1 value columns
+#                 gives N cube files, the basename followed by _1 to 
+#                 _N, all written from the same passes over the file. 
+#
+#   input:  xyzname - Path to the xyz file (string)
+#             atoms - The atom section of the cube file (string)
+#             atNum - The number of atoms (int)
+#       chunkPoints - Lines read per chunk (int)
+#               fmt - One of OUTPUT_FORMATS (string)
+#              pool - multiprocessing pool to format values in, or None
+#            region - Crop and downsampling, see RegionWriter, or None
+#              jobs - Number of processes in pool (int)
+#
+#   return: Paths to the files written (list of string)
 
+def convertXyzFile(xyzname,atoms,atNum,chunkPoints,fmt='cub',pool=None,region=None,jobs=1):
+    if xyzname.lower().endswith('.plt'):
+        return convertPltFile(xyzname,atoms,atNum,chunkPoints,fmt,pool,region,jobs)
 
+    with open(xyzname,'r') as xyzfile:
+        nVals = countXyzValues(xyzfile)
+        bases = [getCubName(xyzname, '')]
+        if nVals > 1:
+            bases = [bases[0]+'_'+str(k+1) for k in range(nVals)]
+            chunkPoints = max(1024, chunkPoints//nVals)
 
+        outs = []
+        try:
+            for base in bases:
+                outs.append(openOutput(base, fmt, atoms, atNum, pool, jobs))
+            #The xyz file is read in chunks, see convertXyzGrid
+            convertXyzGrid(xyzfile,outs,chunkPoints,region=region)
+        finally:
+            for out in outs:
+                out.close()
+    return [base+OUTPUT_FORMATS[fmt][0] for base in bases]
 
-#getAtomNumber - Given a TURBOMOLE atom label, looks up the atomic number
-#    input: atom - A string representing the atom label
+
+#convertPltFile - Converts a Turbomole binary plt grid file to a cube 
+#                 file next to it. The values are memory mapped and 
+#                 written a block at a time, they are never parsed or 
+#                 held in memory whole. Takes the same arguments as 
+#                 convertXyzFile. 
 #
-#    return: dict[atom] - The atomic number associated with the atom (int)
+#   return: Paths to the files written (list of string)
 
-def getAtomNumber( atom ):
+def convertPltFile(pltname,atoms,atNum,chunkPoints,fmt='cub',pool=None,region=None,jobs=1):
+    header, vals = readPlt(pltname)
+    out = openOutput(getCubName(pltname, ''), fmt, atoms, atNum, pool, jobs)
+    try:
+        writer = beginRegion(out, header, region, chunkPoints)
+        #Whole rows of vector 1 are passed on, chunkPoints at most
+        flat = vals.reshape(-1)
+        step = max(1, chunkPoints//header['points'][2])*header['points'][2]
+        for start in range(0, len(flat), step):
+            writer.write(flat[start:start+step])
+        writer.close()
+        del flat
+    finally:
+        out.close()
+    del vals
+    return [getCubName(pltname, OUTPUT_FORMATS[fmt][0])]
 
-   dict={'h'  : 1,  'he' : 2,  'li' : 3,  'be' : 4,  'b'  : 5,  'c'  : 6,      \
-         'n'  : 7,  'o'  : 8,  'f'  : 9,  'ne' : 10, 'na' : 11, 'mg' : 12,     \
-         'al' : 13, 'si' : 14, 'p'  : 15, 's'  : 16, 'cl' : 17, 'ar' : 18,     \
-         'k'  : 19, 'ca' : 20, 'sc' : 21, 'ti' : 22, 'v'  : 23, 'cr' : 24,     \
-         'mn' : 25, 'fe' : 26, 'co' : 27, 'ni' : 28, 'cu' : 29, 'zn' : 30,     \
-         'ga' : 31, 'ge' : 32, 'as' : 33, 'se' : 34, 'br' : 35, 'kr' : 36 }
-   
-   try:
-      if not atom in dict: 
-         raise KeyError(atom)
 
-      return dict[atom]
+#countXyzValues - Number of value columns of an xyz grid file, from its
+#                 first point. Leaves the file at its start. 
+#
+#   input:  xyz - The opened xyz file to be read
+#
+#   return: Number of values per point (int)
+
+def countXyzValues(xyz):
+    nVals = 0
+    for line in xyz:
+        if line.strip() and not line.lstrip().startswith('#'):
+            nVals = len(line.split()) - 3
+            break
+    xyz.seek(0)
+    if nVals < 1:
+        raise ValueError('No grid points found in '+str(getattr(xyz,'name',xyz)))
+    return nVals
+
+
+#convertXyzTask - convertXyzFile taking a single tuple and returning 
+#                 the error instead of raising it, for use by a pool
+#
+#   input:  args - The arguments of convertXyzFile (tuple)
+#
+#   return: xyzname - Path to the xyz file (string)
+#           err     - Error message, or None on success
 
-   except KeyError:
-      print "'" + atom + "' isn't in the dictionary yet. Why not add it?\n"
-      raise
+def convertXyzTask(args):
+    try:
+        convertXyzFile(*args)
+    except (IOError, OSError, ValueError, IndexError, KeyError) as err:
+        return args[0], str(err)
+    return args[0], None
 
 
 
-#isClose - An equality check for floating point numbers that
-#          may fail to be equal when they should be due to rounding 
-#          errors.
+
+#getAtomNumber - Given a TURBOMOLE atom label, looks up the atomic number
+#                in the shared periodic table
+#    input: atom - A string representing the atom label
 #
-#   input:   a,b - floating point numbers that need to be compared
-#        rel_tol - The max percent a,b are allowed to differ and 
-#                  still be considered equal. 
-#        abs_tol - The absolute tolerance for a,b to be considered
-#                  equal.
+#    return: The atomic number associated with the atom (int)
+
+def getAtomNumber( atom ):
+   return int(elements.NUMBER[elements.index(atom)])
 
-def isClose(a, b, rel_tol=1e-09, abs_tol=0.0):
-        return abs(a-b) <= max(rel_tol * max(abs(a), abs(b)), abs_tol)
 
 
-#writeAtCoords -  searches the supplied file 'coord' for a section
+#formatAtCoords - searches the supplied file 'coord' for a section
 #                 beginning with '$coord' and ending with a line 
 #                 containing '$'.
 #                 Within this section it goes line by line taking 
@@ -99,13 +238,13 @@ def isClose(a, b, rel_tol=1e-09, abs_tol=0.0):
 #                 a cube file. 
 #
 #   input:  coord - The opened coord file for reading
-#           cube  - The opened cube file for writing
 #
-#   return: count - The total number of atoms in the coord file
+#   return: atoms - The atom section of the cube file (string)
+#           count - The total number of atoms in the coord file
 
-def writeAtCoords(coord,cube):
+def formatAtCoords(coord):
     started=False
-    count=0
+    lines=[]
 
     for line in coord:
         if( line.find('$coord') != -1 ):
@@ -118,145 +257,1069 @@ def writeAtCoords(coord,cube):
                 atLabel=entry[3]
                 loc=entry[0:3]
                 atNum=getAtomNumber(atLabel)
-                if count == 0 :
-                    cube.write('%5s %12s %12s %12s %12s' % (atNum, '0.000000', loc[0], loc[1], loc[2]))
-                else :
-                    cube.write('\n%5s %12s %12s %12s %12s' % (atNum, '0.000000', loc[0], loc[1], loc[2]))
-                count+=1
+                lines.append('%5s %12s %12s %12s %12s' % (atNum, '0.000000', loc[0], loc[1], loc[2]))
+
+    return '\n'.join(lines), len(lines)
+
+
+#formatCubBlock - formatCubRows taking a single tuple, for use by a pool
+
+def formatCubBlock(args):
+    return formatCubRows(*args)
+
+
+#CubValWriter - Writes values to a cube file in order, formatting them 
+#               in a process pool when one is given. Values are cut into
+#               blocks of whole rows of vector 1, which are formatted in
+#               parallel and written in the order they were added. At 
+#               most two blocks per worker are in flight at any time, 
+#               so memory stays bounded. Output is the same as formatting
+#               everything with formatCubRows. 
+#
+#   input:  cub - The opened cube file for writing to
+#     vec1points - Number of values in a row of vector 1 (int)
+#          pool - multiprocessing pool, or None to format serially
+#     blockRows - Rows of vector 1 per block (int)
+#          jobs - Number of processes in pool (int)
+
+class CubValWriter(object):
+    def __init__(self,cub,vec1points,pool=None,blockRows=4096,jobs=1):
+        self.cub = cub
+        self.vec1points = vec1points
+        self.pool = pool
+        self.block = max(1, blockRows)*vec1points
+        self.pending = collections.deque()
+        self.maxPending = 2*max(1, jobs) if pool is not None else 0
+
+    #write - Adds values, which must be a whole number of rows
+    def write(self,vals):
+        for start in range(0, len(vals), self.block):
+            block = np.array(vals[start:start+self.block])
+            if self.pool is None:
+                self.cub.write(formatCubRows(block, self.vec1points))
+                continue
+
+            self.pending.append(self.pool.apply_async(formatCubBlock, 
+                                                      ((block, self.vec1points),)))
+            while len(self.pending) > self.maxPending:
+                self.cub.write(self.pending.popleft().get())
+
+    #close - Waits for and writes the blocks still being formatted
+    def close(self):
+        while self.pending:
+            self.cub.write(self.pending.popleft().get())
+
+
+#iterXyzChunks - Reads an xyz grid file a fixed number of lines at a 
+#                time, so memory use does not depend on the file size. 
+#
+#   input:  xyz - The opened xyz file to be read
+#   chunkPoints - Lines read per chunk (int)
+#
+#   return: Generator of arrays with rows of x, y, z, values 
+
+def iterXyzChunks(xyz,chunkPoints):
+    while True:
+        lines = list(itertools.islice(xyz, chunkPoints))
+        if not lines:
+            break
+        lines = [ line for line in lines 
+                  if line.strip() and not line.lstrip().startswith('#') ]
+        if lines:
+            yield np.loadtxt(lines, ndmin=2)
+
+
+#gridPoints - Coordinates of a run of consecutive points of a grid, in 
+#             cube order. 
+#
+#   input:  grid - The grid as returned by inferGrid
+#          start - Index of the first point (int)
+#          count - Number of points (int)
+#
+#   return: Point coordinates (count x 3 numpy array)
+
+def gridPoints(grid,start,count):
+    idx = np.unravel_index(np.arange(start, start+count), grid['points'])
+    return grid['origin'] + np.transpose(idx).dot(np.array(grid['incs']))
+
+
+#inferGrid - Works out the origin, the increment of each vector and the 
+#            number of points along it from the point coordinates alone,
+#            using array differences instead of a loop over points. 
+#            Note that I use 1 to refer to the fastest moving vector, 2 
+#            for the second fastest and 3 for the slowest. These are 
+#            typically x, y and z respectively in the xyz file. 
+#
+#            Vector 1 is the first step. Its row ends at the first step
+#            that differs from it, which fixes the points along it. 
+#            Vectors 2 and 3 are found the same way from the rows and 
+#            planes. Every point is then checked against the grid, so a
+#            file not on a regular grid raises ValueError. 
+#
+#            pts may be only the first points of a longer file of n 
+#            points, as long as it holds more than one plane. 
+#
+#   input:  pts - Point coordinates (N x 3 numpy array)
+#           tol - Tolerance on coordinates relative to the smallest step 
+#             n - Total number of points, if pts holds only the first ones
+#
+#   return: grid - Dictionary with the origin ('origin'), the number of
+#                  points ('points') and increments ('incs') of vectors
+#                  3, 2 and 1 in that order
+
+def inferGrid(pts,tol=1e-3,n=None):
+    pts = np.asarray(pts, dtype=np.float64)
+    m = len(pts)
+    n = m if n is None else n
+    origin = pts[0]
+
+    steps = np.diff(pts, axis=0)
+    norms = np.sqrt((steps**2).sum(axis=1))
+    scale = norms[norms > 0].min() if np.any(norms > 0) else 1.
+    atol = tol*scale
+
+    def runLength(diffs):
+        #Number of points along a vector: 1 + leading diffs equal to the first
+        off = np.any(np.abs(diffs - diffs[0]) > atol, axis=1) if len(diffs) \
+              else np.zeros(0, dtype=bool)
+        if off.any():
+            return int(np.argmax(off)) + 1, diffs[0]
+        if m < n:
+            raise ValueError('The first plane of the grid is larger than the '
+                             'points available to infer it from')
+        return len(diffs) + 1, diffs[0] if len(diffs) else np.zeros(3)
+
+    vec1points, inc1 = runLength(steps)
+    vec2points, inc2 = runLength(np.diff(pts[::vec1points], axis=0))
+    plane = vec1points*vec2points
+    if m == n:
+        vec3points, inc3 = runLength(np.diff(pts[::plane], axis=0))
+    elif m > plane:
+        vec3points, inc3 = n//plane, pts[plane] - origin
+    else:
+        raise ValueError('The first plane of the grid is larger than the '
+                         'points available to infer it from')
+    if vec2points == 1: inc2 = np.zeros(3)
+    if vec3points == 1: inc3 = np.zeros(3)
+
+    if plane*vec3points != n:
+        raise ValueError('The %d points do not form a %d x %d x %d grid' % 
+                         (n, vec3points, vec2points, vec1points))
 
-    return count
+    grid = { 'origin' : origin,
+             'points' : [ vec3points, vec2points, vec1points ],
+             'incs'   : [ inc3, inc2, inc1 ],
+             'tol'    : atol }
+    if np.abs(gridPoints(grid, 0, m) - pts).max() > atol:
+        raise ValueError('The points are not on a regular grid ordered with '
+                         'vector 1 fastest')
+    return grid
 
 
-#printCubVals - Pulls the potential values from the xyz input file and 
-#               appends them to the cube file. While doing this it determines
-#               the number of points along each vector, the increment in each 
-#               direction, and the origin for the cube file. It then writes 
-#               these values with a header at the top of the file. Note that
-#               I use 1 to refer to the fastest moving vector, 2 for the 
-#               second fastest and 3 for the slowest. These are typically 
-#               x, y and z respectively in the xyz file. 
+#isCubeOrder - True if vectors 1, 2 and 3 of grid run along x, y and z, 
+#              with zero length allowed for a grid one point thick. 
+
+def isCubeOrder(grid):
+    return all(np.count_nonzero(np.abs(inc) > 0) <= 1 and 
+               np.abs(inc[axis]) == np.abs(inc).max() and inc[axis] >= 0
+               for inc, axis in zip(grid['incs'], [2,1,0]))
+
+
+#axisLattice - Works out an axis aligned grid from the distinct values 
+#              of the point coordinates along x, y and z, without 
+#              assuming any point order. The values along each axis are 
+#              split where the gap between neighbours is more than tol 
+#              of the largest gap, which gives each value an integer 
+#              index along that axis. 
+#
+#   input:  distinct - Sorted distinct values along x, y and z 
+#                      (list of 3 numpy arrays)
+#           tol      - Tolerance relative to the grid spacing
+#
+#   return: lattice - Dictionary with the distinct values ('values') and
+#                     their indices ('ids') along each axis, and the 
+#                     grid in cube order, z slowest and x fastest, as 
+#                     returned by inferGrid ('grid')
+
+def axisLattice(distinct,tol=1e-3):
+    ids, counts, lows, steps = [], [], [], []
+    for vals in distinct:
+        gaps = np.diff(vals)
+        cut = tol*gaps.max() if len(gaps) else 0.
+        axisIds = np.concatenate(([0], np.cumsum(gaps > cut))) if cut > 0 \
+                  else np.zeros(len(vals), dtype=np.intp)
+        ids.append(axisIds.astype(np.intp))
+
+        count = int(axisIds[-1]) + 1
+        counts.append(count)
+        lows.append(vals[0])
+        steps.append((vals[-1] - vals[0])/(count - 1) if count > 1 else 0.)
+
+    steps = np.array(steps)
+    spacing = steps[steps > 0].min() if np.any(steps > 0) else 1.
+    grid = { 'origin' : np.array(lows),
+             'points' : [ counts[2], counts[1], counts[0] ],
+             'incs'   : [ np.array([0., 0., steps[2]]),
+                          np.array([0., steps[1], 0.]),
+                          np.array([steps[0], 0., 0.]) ],
+             'tol'    : tol*spacing }
+    return { 'values' : list(distinct), 'ids' : ids, 'grid' : grid }
+
+
+#latticeIndex - Position in cube order of each point on an axis aligned
+#               lattice. Raises ValueError for points off the lattice. 
+#
+#   input:  lattice - As returned by axisLattice
+#           pts     - Point coordinates (N x 3 numpy array)
+#
+#   return: flat - Position of each point in cube order (N numpy array)
+
+def latticeIndex(lattice,pts):
+    grid = lattice['grid']
+    counts = grid['points'][::-1]
+    idx = np.empty(pts.shape, dtype=np.intp)
+    for axis in range(3):
+        vals = lattice['values'][axis]
+        pos = np.clip(np.searchsorted(vals, pts[:,axis]), 0, len(vals)-1)
+        #The nearest distinct value may be the one before
+        before = np.clip(pos - 1, 0, len(vals)-1)
+        nearer = np.abs(vals[before] - pts[:,axis]) < np.abs(vals[pos] - pts[:,axis])
+        idx[:,axis] = lattice['ids'][axis][np.where(nearer, before, pos)]
+
+    steps = np.array([ grid['incs'][2][0], grid['incs'][1][1], grid['incs'][0][2] ])
+    if np.abs(grid['origin'] + idx*steps - pts).max() > grid['tol']:
+        raise ValueError('The points are not a complete, evenly spaced, axis '
+                         'aligned grid')
+    return (idx[:,2]*counts[1] + idx[:,1])*counts[0] + idx[:,0]
+
+
+#scanXyzGrid - First pass of a chunked conversion. Counts the points, 
+#              keeps the first chunk of them, and collects the distinct 
+#              coordinate values along each axis. The latter are given 
+#              up on (None) if they outgrow a chunk, as they then cannot
+#              describe an axis aligned grid within the memory budget. 
 #
 #   input:  xyz - The opened xyz file to be read
-#           cub - The opened cube file for writing to
+#   chunkPoints - Lines read per chunk (int)
+#
+#   return: n        - Number of points (int)
+#           prefix   - Coordinates of the first chunk of points
+#           distinct - Sorted distinct values along each axis, or None
+
+def scanXyzGrid(xyz,chunkPoints):
+    n = 0
+    prefix = None
+    distinct = [ np.empty(0) ]*3
+    for data in iterXyzChunks(xyz, chunkPoints):
+        n += len(data)
+        if prefix is None:
+            prefix = data[:,0:3].copy()
+        if distinct is not None:
+            distinct = [ np.union1d(vals, data[:,axis]) 
+                         for axis, vals in enumerate(distinct) ]
+            if max(len(vals) for vals in distinct) > chunkPoints:
+                distinct = None
+
+    if n == 0:
+        raise ValueError('No grid points found in '+str(getattr(xyz,'name',xyz)))
+    return n, prefix, distinct
+
+
+#streamCubVals - Second pass of a chunked conversion for files listing 
+#                the points in grid order. Each chunk is checked against
+#                the grid and its values written straight to the cube. 
+#                Raises ValueError at the first point off the grid. 
+#
+#   input:  xyz - The opened xyz file, positioned at its start
+#        writer - Value writer taking a column per value, see 
+#                 ColumnWriter
+#          grid - The grid as returned by inferGrid
+#   chunkPoints - Lines read per chunk (int)
+
+def streamCubVals(xyz,writer,grid,chunkPoints):
+    vec1points = grid['points'][2]
+    start = 0
+    pending = None
+    for data in iterXyzChunks(xyz, chunkPoints):
+        if np.abs(gridPoints(grid, start, len(data)) - data[:,0:3]).max() \
+                > grid['tol']:
+            raise ValueError('The points are not on a regular grid ordered '
+                             'with vector 1 fastest')
+        start += len(data)
+
+        #Only whole rows are written, the rest waits for the next chunk
+        pending = data[:,3:] if pending is None else \
+                  np.concatenate((pending, data[:,3:]))
+        whole = len(pending) - len(pending) % vec1points
+        writer.write(pending[:whole])
+        pending = pending[whole:]
+    writer.close()
+
+
+#reorderCubVals - Second pass of a chunked conversion for files listing 
+#                 the points of an axis aligned grid in any order. The 
+#                 values are scattered into cube order in a memory 
+#                 mapped scratch file, private to this process and 
+#                 removed when closed, then written out in chunks. 
+#
+#   input:  xyz - The opened xyz file, positioned at its start
+#        writer - Value writer taking a column per value, see 
+#                 ColumnWriter
+#       lattice - As returned by axisLattice
+#             n - Number of points (int)
+#   chunkPoints - Lines read per chunk (int)
+
+def reorderCubVals(xyz,writer,lattice,n,chunkPoints):
+    grid = lattice['grid']
+    if np.prod(grid['points']) != n:
+        raise ValueError('The points are not a complete, evenly spaced, axis '
+                         'aligned grid')
+
+    with tempfile.TemporaryFile() as valFile, \
+         tempfile.TemporaryFile() as setFile:
+        vals = np.memmap(valFile, dtype=np.float64, mode='w+', 
+                         shape=(n, writer.columns))
+        filled = np.memmap(setFile, dtype=np.bool_, mode='w+', shape=(n,))
+
+        for data in iterXyzChunks(xyz, chunkPoints):
+            flat = latticeIndex(lattice, data[:,0:3])
+            if filled[flat].any() or len(np.unique(flat)) != len(flat):
+                raise ValueError('The grid holds repeated points')
+            filled[flat] = True
+            vals[flat] = data[:,3:]
+
+        writer.write(vals)
+        writer.close()
+        del vals, filled
+
+
+#convertXyzGrid - Converts an xyz grid file to cube values in chunks of 
+#                 at most chunkPoints points, so memory use is set by 
+#                 chunkPoints rather than by the size of the grid. The 
+#                 file is read once to work out the grid and once more 
+#                 to write the values. Files already iterating along x, 
+#                 y, z in that order are streamed as they are. Otherwise
+#                 the points are placed on an axis aligned grid, see 
+#                 axisLattice, and the values reordered to match. A 
+#                 regular but not axis aligned grid is accepted as long
+#                 as the file lists it in grid order. 
+#
+#   input:  xyz - The opened xyz file to be read
+#           out - Output to write the grid to, see openOutput, or a 
+#                 list of one per value column
+#   chunkPoints - Lines read per chunk (int)
+#        region - Crop and downsampling, see RegionWriter, or None
+
+def convertXyzGrid(xyz,out,chunkPoints,tol=1e-3,region=None):
+    outs = out if isinstance(out, list) else [out]
+    n, prefix, distinct = scanXyzGrid(xyz, chunkPoints)
+
+    try:
+        grid = inferGrid(prefix, tol, n)
+    except ValueError:
+        grid = None
+    try:
+        lattice = axisLattice(distinct, tol) if distinct is not None else None
+    except ValueError:
+        lattice = None
+
+    if grid is not None and (isCubeOrder(grid) or lattice is None):
+        xyz.seek(0)
+        writer = ColumnWriter([beginRegion(out, grid, region, chunkPoints) 
+                               for out in outs])
+        try:
+            streamCubVals(xyz, writer, grid, chunkPoints)
+            return
+        except ValueError:
+            #Start over below if the file only began in grid order
+            if lattice is None:
+                raise
+            for out in outs:
+                out.restart()
+
+    if lattice is None:
+        raise ValueError('The points are not on a regular grid, or its planes '
+                         'do not fit in the memory allowed')
+
+    xyz.seek(0)
+    writer = ColumnWriter([beginRegion(out, lattice['grid'], region, chunkPoints)
+                           for out in outs])
+    reorderCubVals(xyz, writer, lattice, n, chunkPoints)
+
+
+#ColumnWriter - Passes each column of values to its own value writer, 
+#               for xyz files holding several values per point
+#
+#   input:  writers - One value writer per column (list)
+
+class ColumnWriter(object):
+    def __init__(self,writers):
+        self.writers = writers
+        self.columns = len(writers)
+
+    #write - Adds rows of values, one column per writer
+    def write(self,vals):
+        if vals.shape[1] != self.columns:
+            raise ValueError('Every point must hold '+str(self.columns)+' values')
+        for k, writer in enumerate(self.writers):
+            writer.write(vals[:,k])
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+
+#beginRegion - Starts writing a grid to an output, through a 
+#              RegionWriter if a region is given
+#
+#   input:  out - Output to write the grid to, see openOutput
+#          grid - The grid as returned by inferGrid
+#        region - Crop and downsampling, see RegionWriter, or None
+#   chunkPoints - Lines read per chunk (int)
+#
+#   return: The value writer
+
+def beginRegion(out,grid,region,chunkPoints):
+    if region is None:
+        return out.begin(grid, max(1, chunkPoints//(4*grid['points'][2])))
+    regionWriter = RegionWriter(grid, region)
+    kept = regionWriter.grid
+    regionWriter.writer = out.begin(kept, max(1, chunkPoints//(4*kept['points'][2])))
+    return regionWriter
+
+
+#atomBox - The box holding the chosen atoms plus a padding on each side
+#
+#   input:  atoms - The atom section of the cube, from formatAtCoords
+#         numbers - Atom numbers, counting from 1 (list of int)
+#             pad - Padding in bohr (float)
+#
+#   return: Lowest and highest corner of the box (2 x 3 numpy array)
+
+def atomBox(atoms,numbers,pad):
+    xyz = atomCoords(atoms)
+    numbers = np.asarray(numbers, dtype=np.intp)
+    if len(numbers) == 0 or numbers.min() < 1 or numbers.max() > len(xyz):
+        raise ValueError('Atom numbers must be between 1 and '+str(len(xyz)))
+    chosen = xyz[numbers-1]
+    return np.array([chosen.min(axis=0) - pad, chosen.max(axis=0) + pad])
+
+
+#atomCoords - The positions of the atoms of a cube
+#
+#   input:  atoms - The atom section of the cube, from formatAtCoords
+#
+#   return: Atom positions in bohr (N x 3 numpy array)
+
+def atomCoords(atoms):
+    return np.array([line.split()[2:5] for line in atoms.split('\n') if line.strip()],
+                    dtype=np.float64).reshape(-1, 3)
+
+
+#parseAtomList - Reads atom numbers written as in define, e.g. 1-3,7
+#
+#   input:  text - The atom list (string)
+#
+#   return: Atom numbers (list of int)
+
+def parseAtomList(text):
+    numbers = []
+    for part in text.replace(' ', '').split(','):
+        if not part:
+            continue
+        ends = part.split('-')
+        if len(ends) == 1:
+            numbers.append(int(ends[0]))
+        else:
+            numbers.extend(range(int(ends[0]), int(ends[1])+1))
+    return numbers
+
+
+#RegionWriter - Crops and downsamples a grid on its way to an output.
+#               Sits in front of a value writer, taking the values of 
+#               the full grid in cube order and passing on those of the
+#               region only, a plane of vector 3 at a time, so the full 
+#               grid is never written or held in memory. 
+#
+#               region is a dict holding
+#                 'box'     - Lowest and highest corner of the box to 
+#                             keep in bohr, or None for the whole grid. 
+#                             Points on or inside it are kept. 
+#                 'step'    - Downsampling factor along each vector (int)
+#                 'average' - If set each step x step x step block of
+#                             points is replaced by its mean, placed at
+#                             its centre, otherwise every step-th point
+#                             is kept. Blocks running off the region are
+#                             dropped. 
+#
+#   input:  grid - The full grid as returned by inferGrid
+#         region - The region (dict)
+#         writer - Value writer the region is passed to, may be set 
+#                  later, once the output has begun with self.grid
+
+class RegionWriter(object):
+    def __init__(self,grid,region,writer=None):
+        self.writer = writer
+        self.step = max(1, int(region.get('step', 1)))
+        self.average = bool(region.get('average', False)) and self.step > 1
+        self.shape = tuple(grid['points'])
+        self.lo, self.hi = regionBounds(grid, region.get('box'))
+
+        #The grid of the region after downsampling
+        span = self.hi - self.lo
+        if self.average:
+            points = span//self.step
+            first = self.lo + (self.step-1)/2.
+        else:
+            points = -(-span//self.step)
+            first = self.lo
+        if (points < 1).any():
+            raise ValueError('The region holds no grid points')
+        incs = [np.asarray(inc, dtype=np.float64) for inc in grid['incs']]
+        self.grid = {'origin' : np.asarray(grid['origin']) + sum(f*inc for f, inc in zip(first, incs)),
+                     'points' : [int(p) for p in points],
+                     'incs' : [inc*self.step for inc in incs],
+                     'tol' : grid.get('tol', 0.0)}
+        self.kept = points
+
+        self.i3 = 0
+        self.pending = np.empty(0)
+        self.group = []
+
+    #write - Adds values of the full grid, a whole number of rows 
+    def write(self,vals):
+        n3, n2, n1 = self.shape
+        size = n2*n1
+        start = 0
+        if len(self.pending):
+            start = min(len(vals), size - len(self.pending))
+            self.pending = np.concatenate((self.pending, vals[:start]))
+            if len(self.pending) < size:
+                return
+            self.addPlane(self.pending.reshape(n2, n1))
+            self.pending = np.empty(0)
+        while len(vals) - start >= size:
+            self.addPlane(np.asarray(vals[start:start+size]).reshape(n2, n1))
+            start += size
+        self.pending = np.array(vals[start:])
+
+    #addPlane - Takes the next plane of vector 3 of the full grid
+    def addPlane(self,plane):
+        i3 = self.i3
+        self.i3 += 1
+        lo, hi, step = self.lo, self.hi, self.step
+        offset = i3 - lo[0]
+        limit = self.kept[0]*step if self.average else hi[0] - lo[0]
+        if offset < 0 or offset >= limit or (not self.average and offset % step):
+            return
+
+        plane = plane[lo[1]:hi[1], lo[2]:hi[2]]
+        if not self.average:
+            self.writer.write(plane[::step, ::step].ravel())
+            return
+
+        self.group.append(plane[:self.kept[1]*step, :self.kept[2]*step])
+        if len(self.group) == step:
+            block = np.array(self.group).reshape(step, self.kept[1], step, 
+                                                 self.kept[2], step)
+            self.writer.write(block.mean(axis=(0, 2, 4)).ravel())
+            self.group = []
+
+    def close(self):
+        self.writer.close()
+
+
+#regionBounds - The range of indices along each vector of a grid whose
+#               points lie in a box. Each vector is taken along the 
+#               Cartesian axis it mostly runs along. 
+#
+#   input:  grid - The grid as returned by inferGrid
+#            box - Lowest and highest corner of the box, or None
+#
+#   return: lo - First index kept along vectors 3, 2, 1 (numpy array)
+#           hi - One past the last index kept (numpy array)
+
+def regionBounds(grid,box,tol=1e-6):
+    points = np.array(grid['points'], dtype=np.intp)
+    lo = np.zeros(3, dtype=np.intp)
+    hi = points.copy()
+    if box is None:
+        return lo, hi
+
+    box = np.asarray(box, dtype=np.float64)
+    origin = np.asarray(grid['origin'], dtype=np.float64)
+    for k, inc in enumerate(grid['incs']):
+        inc = np.asarray(inc, dtype=np.float64)
+        c = np.argmax(np.abs(inc))
+        ends = np.sort((box[:, c] - origin[c])/inc[c])
+        lo[k] = max(0, int(np.ceil(ends[0] - tol)))
+        hi[k] = min(points[k], int(np.floor(ends[1] + tol)) + 1)
+    return lo, hi
+
+
+#writeCubHeader - Writes the two comment lines and the grid 
+#                 specification that start a cube file. 
+#
+#   input:  cub - The opened cube file for writing to
+#          grid - The grid as returned by inferGrid
 #         atNum - The number of atoms in the associated coord file (int)
 
-def printCubVals(xyz,cub,atNum):
-    cub.seek(0,2) #go to end of file
-    comment=re.compile('^\w*\#') #Allows full line comments with #
-
-    #Need a temp file because some text must be inserted at the top
-    #of the final cube file that we won't know until the end. 
-    header=open('cubHeader.tmp','w')
-
-    #initializing variables to count the number of points and other flags
-    vec1points = vec2points = vec3points = blockCount = valCount = 0
-    first=True
-    vec2incremented = cycleFin = False
-
-    for line in xyz: 
-        if not comment.search(line) :
-            if ( not line.strip() == '' ) :
-                entry = [ float(x) for x in line.split() ]
-                loc = entry[0:3]
-                vstep = entry[3]
-
-                #Counts the number of times 2 increments itself using the 
-                #fact there is always a blank line in the file before it happens 
-                if not ( 'x3inc' in locals() or 'x3inc' in globals() ) and \
-                        cycleFin :
-                    vec2points+=1
-
-
-                #Responsible for figuring out the variables associated with the
-                #grid. 
-                if first :
-                    origin=loc
-                    lastLoc=loc
-                    first=False
-                
-                #First increment will be in vector 1
-                elif not ( 'x1inc' in locals() or 'x1inc' in globals() ):
-                    x1inc=loc[0] - origin[0]
-                    y1inc=loc[1] - origin[1]
-                    z1inc=loc[2] - origin[2]
-
-                #The increment after first block break will be in vector 2
-                elif not ( 'x2inc' in locals() or 'x2inc' in globals() ) and \
-                        blockCount == 1 :
-                    x2inc=loc[0] - origin[0]
-                    y2inc=loc[1] - origin[1]
-                    z2inc=loc[2] - origin[2]
-
-                #After a wraparound in vector 2, the increment will be in vector 3.
-                #A block end marks an increment in vector 2 OR 3. 
-                #To tell if it was vector 2 or 3 that was iterated through we 
-                #see whether the increment is comparable to what we've already
-                #determined vector 2's increment looks like.
-                elif not ( 'x3inc' in locals() or 'x3inc' in globals() ) and \
-                     cycleFin and \
-                     not ( isClose(loc[0]-lastLoc[0],x2inc,1e-5,0) and \
-                           isClose(loc[1]-lastLoc[1],y2inc,1e-5,0) and \
-                           isClose(loc[2]-lastLoc[2],z2inc,1e-5,0) ):
-
-                    x3inc=loc[0] - origin[0]
-                    y3inc=loc[1] - origin[1]
-                    z3inc=loc[2] - origin[2]
-
-
-                #Counts number of points before 2 is incremented, so the number
-                #of points in the first block of numbers. 
-                if not ( 'x2inc' in locals() or 'x2inc' in globals() ):
-                    vec1points+=1
-
-
-                if cycleFin:
-                    lastLoc=loc
-
-                #After a full cycle of vector1 or after printing 
-                #six values we need to go to a new line. 
-                if cycleFin or valCount % 6 == 0: 
-                    cub.write('\n')
-                    cycleFin=False
-
-
-                cub.write('%14.6e' % (vstep) )
-                valCount += 1
-
-
-            else:
-                cycleFin=True
-                valCount=0
-
-                #This count will be off if there is no final empty line in the xyz
-                blockCount+=1
-
-    
-    vec3points = blockCount/vec2points
-
-    header.write('\n')
-    header.write('INCREMENT FAST,MED,SLOW: X,Y,Z\n')
-    header.write('%5d %12.8f %12.8f %12.8f \n' % ( atNum, origin[0], origin[1], origin[2] ) )
-    header.write('%5d %12.8f %12.8f %12.8f \n' % ( vec3points, x3inc, y3inc, z3inc ) )
-    header.write('%5d %12.8f %12.8f %12.8f \n' % ( vec2points, x2inc, y2inc, z2inc ) )
-    header.write('%5d %12.8f %12.8f %12.8f \n' % ( vec1points, x1inc, y1inc, z1inc ) )
-    header.close()
-    cubname=cub.name
-    cub.close()
-
-
-        
-    p=Popen('cat cubHeader.tmp '+cubname+' > finalCub.tmp',shell=True)
-    p.wait()
-    p=Popen('mv finalCub.tmp '+cubname,shell=True)
-    p.wait()
-    p=Popen('rm cubHeader.tmp',shell=True)
-    p.wait()
-
-
-#            In testing this code .xyz files have been found that do not increment xyz in the 
-#            correct order. If the dimensions of the .cub file are incorrect check if this is 
-#            the case. If not, the next most likely points of failure are lack of a new line
-#            ending the file and the rel_tol variable for the isClose calls being a bad size. 
+def writeCubHeader(cub,grid,atNum):
+    origin = grid['origin']
+    cub.write('\n')
+    cub.write('INCREMENT FAST,MED,SLOW: X,Y,Z\n')
+    cub.write('%5d %12.8f %12.8f %12.8f \n' % ( atNum, origin[0], origin[1], origin[2] ) )
+    for points, inc in zip(grid['points'], grid['incs']):
+        cub.write('%5d %12.8f %12.8f %12.8f \n' % ( points, inc[0], inc[1], inc[2] ) )
+
+
+#formatCubRows - Formats whole rows of vector 1 as cube text. Each row 
+#                starts on a new line and holds six values per line. 
+#                All rows share one format string, so a block of rows 
+#                is formatted with a single % operation. 
+#
+#   input:  vals - Values of a whole number of rows (numpy array)
+#     vec1points - Number of values in a row (int)
+#
+#   return: The formatted text (string)
+
+def formatCubRows(vals,vec1points):
+    lines = ['%14.6e'*6]*(vec1points//6)
+    if vec1points % 6:
+        lines.append('%14.6e'*(vec1points % 6))
+    rowFmt = '\n' + '\n'.join(lines)
+    return (rowFmt*(len(vals)//vec1points)) % tuple(vals.tolist())
+
+
+#CubOutput - Writes a grid as a text cube file, gzip compressed when 
+#            compress is set. The text is the same either way. 
+#
+#   input:  name - Path to the cube file (string)
+#          atoms - The atom section of the cube, from formatAtCoords
+#          atNum - The number of atoms (int)
+#           pool - multiprocessing pool to format values in, or None
+#       compress - Whether to gzip the file (bool)
+#           jobs - Number of processes in pool (int)
+
+class CubOutput(object):
+    def __init__(self,name,atoms,atNum,pool=None,compress=False,jobs=1):
+        self.atoms = atoms
+        self.atNum = atNum
+        self.pool = pool
+        self.jobs = jobs
+        self.compress = compress
+        self.raw = open(name,'wb')
+        self.openText()
+
+    #openText - Starts the text stream at the current end of the file
+    def openText(self):
+        stream = self.raw
+        if self.compress:
+            stream = gzip.GzipFile(fileobj=self.raw, mode='wb', 
+                                   compresslevel=GZIP_LEVEL)
+        self.cub = io.TextIOWrapper(stream, encoding='ascii', newline='\n')
+
+    #begin - Writes the header and atoms and returns the value writer
+    def begin(self,grid,blockRows):
+        writeCubHeader(self.cub, grid, self.atNum)
+        self.cub.write(self.atoms)
+        return CubValWriter(self.cub, grid['points'][2], self.pool, blockRows, self.jobs)
+
+    #restart - Throws away everything written so far
+    def restart(self):
+        stream = self.cub.detach()
+        if self.compress:
+            stream.close()
+        self.raw.seek(0)
+        self.raw.truncate()
+        self.openText()
+
+    def close(self):
+        self.cub.close()
+        self.raw.close()
+
+
+#RawValWriter - Writes values to a volume file as raw binary, a block 
+#               at a time so a large or memory mapped input is never 
+#               copied whole
+#
+#   input:  vol - The opened volume file for writing to, binary mode
+#         dtype - numpy type the values are stored as
+#   blockPoints - Values converted and written at a time (int)
+
+class RawValWriter(object):
+    def __init__(self,vol,dtype,blockPoints=2**20):
+        self.vol = vol
+        self.dtype = np.dtype(dtype)
+        self.block = max(1, blockPoints)
+
+    def write(self,vals):
+        for start in range(0, len(vals), self.block):
+            block = np.ascontiguousarray(vals[start:start+self.block], dtype=self.dtype)
+            self.vol.write(block.tobytes())
+
+    def close(self):
+        self.vol.flush()
+
+
+#VolOutput - Writes a grid as a raw volume, the values in cube order as 
+#            little endian floats with nothing around them, so the file
+#            can be memory mapped. The grid, the atoms and the type are
+#            kept in a JSON sidecar next to it, see readVolume. 
+#
+#   input:  name - Path to the volume file (string), the sidecar is the 
+#                  same path followed by .json
+#          atoms - The atom section of the cube, from formatAtCoords
+#          atNum - The number of atoms (int)
+#          dtype - '<f4' or '<f8'
+
+class VolOutput(object):
+    def __init__(self,name,atoms,atNum,dtype='<f8'):
+        self.name = name
+        self.atoms = atoms
+        self.atNum = atNum
+        self.dtype = np.dtype(dtype).str
+        self.vol = open(name,'wb')
+
+    def begin(self,grid,blockRows):
+        header = {'version' : VOLUME_VERSION, 'dtype' : self.dtype,
+                  'origin' : [float(x) for x in grid['origin']],
+                  'points' : [int(x) for x in grid['points']],
+                  'incs' : [[float(x) for x in inc] for inc in grid['incs']],
+                  'atNum' : self.atNum, 'atoms' : self.atoms}
+        with open(self.name+'.json','w') as side:
+            json.dump(header, side, indent=1)
+            side.write('\n')
+        return RawValWriter(self.vol, self.dtype, blockRows*grid['points'][2])
+
+    def restart(self):
+        self.vol.seek(0)
+        self.vol.truncate()
+
+    def close(self):
+        self.vol.close()
+
+
+#openOutput - Opens the output of a conversion in one of OUTPUT_FORMATS
+#
+#   input:  base - Path of the output without its extension (string)
+#            fmt - One of OUTPUT_FORMATS (string)
+#          atoms - The atom section of the cube, from formatAtCoords
+#          atNum - The number of atoms (int)
+#           pool - multiprocessing pool to format values in, or None
+#           jobs - Number of processes in pool (int)
+#
+#   return: The output, a CubOutput or VolOutput
+
+def openOutput(base,fmt,atoms,atNum,pool=None,jobs=1):
+    ext, dtype = OUTPUT_FORMATS[fmt]
+    if dtype is None:
+        return CubOutput(base+ext, atoms, atNum, pool, ext.endswith('.gz'), jobs)
+    return VolOutput(base+ext, atoms, atNum, dtype)
+
+
+#readCub - Reads a cube file, gzip compressed if its name ends in .gz. 
+#
+#   input:  name - Path to the cube file (string)
+#
+#   return: header - The grid as for inferGrid, with the atom section 
+#                    as written by formatAtCoords under 'atoms' and the
+#                    number of atoms under 'atNum' (dict)
+#           vals   - The values, shaped as the points of the grid 
+#                    (numpy array)
+
+def readCub(name):
+    opener = gzip.open if name.endswith('.gz') else open
+    with opener(name,'rt') as cub:
+        header = readCubHeader(cub)
+        vals = np.array(cub.read().split(), dtype=np.float64)
+
+    if len(vals) != np.prod(header['points']):
+        raise ValueError('The cube file '+name+' holds '+str(len(vals))+
+                         ' values, its grid has '+str(np.prod(header['points'])))
+    return header, vals.reshape(header['points'])
+
+
+#readCubHeader - Reads the comment lines, grid specification and atom 
+#                section that start a cube file, leaving the file at 
+#                the first value. 
+#
+#   input:  cub - The opened cube file for reading, text or binary
+#
+#   return: The header as returned by readCub (dict)
+
+def readCubHeader(cub):
+    def readline():
+        line = cub.readline()
+        if not line:
+            raise ValueError('unexpected end of file')
+        return line.decode('ascii') if isinstance(line, bytes) else line
+
+    try:
+        readline()
+        readline()
+        entry = readline().split()
+        atNum = abs(int(entry[0]))
+        header = {'origin' : np.array(entry[1:4], dtype=np.float64), 
+                  'points' : [], 'incs' : [], 'atNum' : atNum}
+        for i in range(3):
+            entry = readline().split()
+            header['points'].append(int(entry[0]))
+            header['incs'].append(np.array(entry[1:4], dtype=np.float64))
+            if header['points'][-1] < 1 or len(header['incs'][-1]) != 3:
+                raise ValueError('bad grid vector')
+
+        #The last atom line has no newline, the values start on the next
+        atoms = [readline() for i in range(atNum)]
+    except (IndexError, ValueError):
+        raise ValueError(str(getattr(cub, 'name', 'The file'))+' is not a cube file')
+    header['atoms'] = ''.join(atoms)[:-1] if atNum else ''
+    return header
+
+
+#readVolume - Reads a volume written by VolOutput, memory mapping the 
+#             values rather than reading them. 
+#
+#   input:  name - Path to the volume file (string)
+#           mode - numpy.memmap mode, 'r' for read only (string)
+#
+#   return: header - The grid as returned by readCub (dict)
+#           vals   - The values, shaped as the points of the grid 
+#                    (numpy memmap)
+
+def readVolume(name,mode='r'):
+    with open(name+'.json','r') as side:
+        header = json.load(side)
+    if header.get('version') != VOLUME_VERSION:
+        raise ValueError('Unknown volume version in '+name+'.json')
+
+    header['origin'] = np.array(header['origin'])
+    header['incs'] = [np.array(inc) for inc in header['incs']]
+    vals = np.memmap(name, dtype=header.pop('dtype'), mode=mode, 
+                     shape=tuple(header['points']))
+    return header, vals
+
+
+#readPlt - Reads a gOpenMol format plt file, as written by Turbomole for
+#          $pointval grids. The file holds the rank (3), a type code, 
+#          the points along z, y and x, the lowest and highest z, y 
+#          and x in angstrom, then float32 values with x fastest. The 
+#          values are memory mapped where they lie in the file. Either 
+#          byte order is read. 
+#
+#   input:  name - Path to the plt file (string)
+#
+#   return: header - The grid as returned by readCub, in bohr, with no 
+#                    atoms (dict)
+#           vals   - The values, shaped as the points of the grid 
+#                    (numpy memmap)
+
+def readPlt(name):
+    with open(name,'rb') as plt:
+        head = plt.read(PLT_HEADER_BYTES)
+        size = os.fstat(plt.fileno()).st_size
+    if len(head) < PLT_HEADER_BYTES:
+        raise ValueError(name+' is too short to be a plt file')
+
+    for order in '<>':
+        ints = np.frombuffer(head, dtype=order+'i4', count=5)
+        if ints[0] == 3:
+            break
+    else:
+        raise ValueError(name+' is not a plt file of a 3D grid')
+
+    points = [int(n) for n in ints[2:5]]
+    if min(points) < 1 or size != PLT_HEADER_BYTES + 4*int(np.prod(points)):
+        raise ValueError('The size of '+name+' does not match its grid of '+
+                         ' x '.join(str(n) for n in points)+' points')
+
+    #Limits are z, y, x pairs, the grid vectors run along z, y, x
+    limits = np.frombuffer(head, dtype=order+'f4', count=6, offset=20)
+    limits = limits.astype(np.float64).reshape(3, 2)*ANG_2_BOHR
+    incs = []
+    for k, n in enumerate(points):
+        inc = np.zeros(3)
+        inc[2-k] = (limits[k,1] - limits[k,0])/(n - 1) if n > 1 else 0.0
+        incs.append(inc)
+
+    header = {'origin' : limits[::-1,0].copy(), 'points' : points, 
+              'incs' : incs, 'atNum' : 0, 'atoms' : ''}
+    vals = np.memmap(name, dtype=order+'f4', mode='r', offset=PLT_HEADER_BYTES,
+                     shape=tuple(points))
+    return header, vals
+
+
+#CubReader - Reads parts of a cube file without loading the whole grid. 
+#            It is indexed like a numpy array shaped as the points of 
+#            the grid, e.g. reader[10], reader[:,5:20,::2] or 
+#            reader[:,:,3], and returns a numpy array. The first read 
+#            scans the file once for where each row of vector 1 starts,
+#            after that only the rows covered are read. This needs each
+#            row to start on a new line with six values per line, as 
+#            written by xyz2cub and Gaussian, other cube files are read
+#            whole on first use. Raw volumes written with -f vol32 or 
+#            vol64 and Turbomole plt files are memory mapped. 
+#
+#   input:  name - Path to a .cub, .cub.gz, .vol or .plt file (string)
+
+class CubReader(object):
+    def __init__(self,name):
+        self.name = name
+        self.cub = None
+        self.vals = None
+        self.rowStarts = None
+        if name.endswith('.vol'):
+            self.header, self.vals = readVolume(name)
+        elif name.lower().endswith('.plt'):
+            self.header, self.vals = readPlt(name)
+        else:
+            opener = gzip.open if name.endswith('.gz') else open
+            self.cub = opener(name,'rb')
+            try:
+                self.header = readCubHeader(self.cub)
+            except ValueError:
+                self.close()
+                raise
+            self.dataStart = self.cub.tell()
+        self.shape = tuple(self.header['points'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def close(self):
+        if self.cub is not None:
+            self.cub.close()
+            self.cub = None
+
+    def __getitem__(self,key):
+        if self.vals is None and self.rowStarts is None:
+            self.indexRows()
+        if self.vals is not None:
+            return np.array(self.vals[key])
+
+        key = key if isinstance(key, tuple) else (key,)
+        if len(key) > 3:
+            raise IndexError('A cube has three dimensions')
+        key = key + (slice(None),)*(3-len(key))
+        n3, n2, n1 = self.shape
+        sel3 = range(n3)[key[0]]
+        sel2 = range(n2)[key[1]]
+        rows2 = sel2 if isinstance(sel2, range) else range(sel2, sel2+1)
+
+        planes = []
+        for i3 in (sel3 if isinstance(sel3, range) else [sel3]):
+            if len(rows2) == 0:
+                planes.append(np.empty((0, n1))[:, key[2]])
+                continue
+            lo, hi = min(rows2), max(rows2)
+            rows = self.readRows(i3*n2 + lo, hi - lo + 1)
+            planes.append(rows[np.array(rows2) - lo][:, key[2]])
+
+        vals = np.array(planes).reshape((len(planes), len(rows2)) + 
+                                        np.empty(n1)[key[2]].shape)
+        if not isinstance(sel2, range):
+            vals = vals[:, 0]
+        if not isinstance(sel3, range):
+            vals = vals[0]
+        return vals
+
+    #iterPlanes - Yields the planes of vector 3 in order, each n2 x n1,
+    #             reading the file front to back without indexing it. 
+    #             Works for any layout of the values. 
+    def iterPlanes(self,chunkBytes=2**22):
+        n3, n2, n1 = self.shape
+        if self.vals is not None:
+            for i3 in range(n3):
+                yield np.array(self.vals[i3])
+            return
+
+        self.cub.seek(self.dataStart)
+        size = n2*n1
+        pending = np.empty(0)
+        tail = b''
+        planes = 0
+        while planes < n3:
+            chunk = self.cub.read(chunkBytes)
+            #A value may be split across chunks, it is kept for the next
+            text = tail + chunk
+            if chunk:
+                cut = max(text.rfind(b' '), text.rfind(b'\n')) + 1
+                text, tail = text[:cut], text[cut:]
+            pending = np.concatenate((pending, 
+                                      np.array(text.split(), dtype=np.float64)))
+            while len(pending) >= size and planes < n3:
+                yield pending[:size].reshape(n2, n1)
+                pending = pending[size:]
+                planes += 1
+            if not chunk and planes < n3:
+                raise ValueError('The cube file '+self.name+' holds fewer values '+
+                                 'than its grid')
+
+    #indexRows - Scans the file for the byte offset of the start of each 
+    #            row of vector 1, reading it whole if rows do not start 
+    #            on their own lines
+    def indexRows(self,chunkBytes=2**24):
+        n3, n2, n1 = self.shape
+        nRows = n3*n2
+        perRow = -(-n1//6)
+        starts = np.zeros(nRows+1, dtype=np.int64)
+
+        #The first row starts at the first value, later rows each 
+        #perRow lines further on
+        self.cub.seek(self.dataStart)
+        pos = self.dataStart
+        lines = None
+        while True:
+            chunk = self.cub.read(chunkBytes)
+            if not chunk:
+                break
+            if lines is None:
+                stripped = chunk.lstrip()
+                if not stripped:
+                    pos += len(chunk)
+                    continue
+                pos += len(chunk) - len(stripped)
+                chunk = stripped
+                starts[0] = pos
+                lines = 0
+
+            breaks = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 10)
+            line = lines + 1 + np.arange(len(breaks))
+            first = line % perRow == 0
+            row = line[first] // perRow
+            keep = row < nRows
+            starts[row[keep]] = pos + breaks[first][keep] + 1
+            lines += len(breaks)
+            pos += len(chunk)
+        starts[nRows] = pos
+        self.rowStarts = starts
+
+        try:
+            aligned = lines is not None and nRows > 0 and \
+                      lines + 1 >= nRows*perRow
+            if aligned:
+                self.readRows(0, 1)
+                self.readRows(nRows-1, 1)
+        except ValueError:
+            aligned = False
+        if not aligned:
+            self.rowStarts = None
+            self.header, self.vals = readCub(self.name)
+
+    #readRows - Reads count consecutive rows of vector 1 from row first
+    def readRows(self,first,count):
+        self.cub.seek(self.rowStarts[first])
+        text = self.cub.read(self.rowStarts[first+count] - self.rowStarts[first])
+        vals = np.array(text.split(), dtype=np.float64)
+        n1 = self.shape[2]
+        if len(vals) != count*n1:
+            raise ValueError('The cube file '+self.name+' does not hold '+
+                             str(n1)+' values in row '+str(first))
+        return vals.reshape(count, n1)
+
 
 if __name__ == '__main__' :
     parser = argparse.ArgumentParser(description='This program takes as input a Turbomole xyz '+ 
@@ -264,18 +1327,70 @@ if __name__ == '__main__' :
             'to a cub format file. This xyz file is NOT the same as a coordinate xyz file.\n'  +
 
             'It does this by looking at the number of entries and the distance apart they '    +
-            'are. It relies on the fact values start at the gridpoint with the smallest '      +
-            'possible coordinates and the file iterates along x, y, z, in that order. Each '   +
-            'y/z increment must be marked by a newline. The output file will be the input xyz '+
-            "file's basename followed by .cub\n")
+            'are. The points may be listed in any order, the cube always iterates along x, '   +
+            'y, z, in that order. Blank lines between blocks are allowed but not needed. The ' +
+            "output file will be the input xyz file's basename followed by .cub, or by _1.cub, " +
+            "_2.cub and so on if each point holds several values. Several xyz " +
+            "files sharing one coord file can be converted in one call.\n")
 
-    parser.add_argument('xyzName',nargs=1, help='The name of the .xyz file that needs to be '+
-                        'converted.')
+    parser.add_argument('xyzName',nargs='+', help='The names of the .xyz files that need to be '+
+                        'converted, all sharing the same coord file. Turbomole binary .plt grid '+
+                        'files are read as well.')
 
     parser.add_argument('-c','--coord',default='./coord',help='Allows the user to specify the '+
                         'path to a Turbomole coordinate file. (Default: ./coord)') 
 
+    parser.add_argument('-m','--memory',type=int,default=256,help='Approximate peak memory '+
+                        'in MB the conversion may use, whatever the size of the grid. '+
+                        '(Default: 256)')
+
+    parser.add_argument('-j','--jobs',type=int,default=1,help='Number of processes. With '+
+                        'several xyz files that many are converted at once, with one its '+
+                        'values are formatted in that many. The output is the same for any number. '+
+                        '(Default: 1)')
+
+    parser.add_argument('-f','--format',default='cub',choices=sorted(OUTPUT_FORMATS),
+                        help='Output written. cub.gz is a gzip compressed cube file, vol32 '+
+                        'and vol64 a raw little endian float32 or float64 volume that can be '+
+                        'memory mapped, with its grid and atoms in a .vol.json file next to '+
+                        'it. (Default: cub)')
+
+    crop = parser.add_mutually_exclusive_group()
+    crop.add_argument('--box',type=float,nargs=6,default=None,
+                      metavar=('XMIN','YMIN','ZMIN','XMAX','YMAX','ZMAX'),
+                      help='Only write the points inside this box, in bohr.')
+
+    crop.add_argument('--around',default=None,help='Only write the points within --pad of '+
+                      'these atoms in each direction, numbered from 1 as in the coord file, '+
+                      'e.g. 1-3,7.')
+
+    parser.add_argument('--pad',type=float,default=5.0,help='Padding in bohr around the '+
+                        'atoms of --around. (Default: 5.0)')
+
+    sample = parser.add_mutually_exclusive_group()
+    sample.add_argument('--stride',type=int,default=1,help='Only write every N-th point along '+
+                        'each vector. (Default: 1)')
+
+    sample.add_argument('--average',type=int,default=None,help='Write the mean of each block '+
+                        'of N x N x N points, at the centre of the block.')
+
     args = parser.parse_args()
 
+    try:
+        around = parseAtomList(args.around) if args.around else None
+    except ValueError:
+        parser.error('Could not read the atom list '+args.around)
+
+    region = None
+    if args.box or args.around or args.stride > 1 or args.average:
+        region = {'box' : [args.box[0:3], args.box[3:6]] if args.box else None,
+                  'around' : around,
+                  'pad' : args.pad,
+                  'step' : args.average or args.stride,
+                  'average' : args.average is not None}
+
 
-    xyz2cub(args.xyzName,args.coord)
+    try:
+        xyz2cub(args.xyzName,args.coord,args.memory,args.jobs,args.format,region)
+    except ValueError as err:
+        parser.error(str(err))
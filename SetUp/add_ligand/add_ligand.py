@@ -582,6 +582,27 @@ class ForceField(object):
 
 
 
+    def _params_MMFF94(self,label):
+        """
+        Returns the parameters of the element with atomic label label.
+        Every element without its own entry defaults to iron because 
+        they would likely be larger elements. A warning is printed the 
+        first time each such label is seen. Reader stores labels as 
+        bytes, so they are decoded before the lookup.
+        """
+        if isinstance(label,bytes):
+            label = label.decode()
+        try:
+            return self.at_dict[label]
+        except KeyError:
+            pass
+
+        print('Warning: No MMFF94 parameters for ' + str(label)
+             + ', using those of Fe', file=sys.stderr)
+        self.at_dict[label] = self.at_dict['Fe']
+        return self.at_dict[label]
+
+
     # Could probably just save this info for all possible pairs if
     # we wanted to, then no memoization needed
     # Decorator only defined in Python 3
@@ -594,21 +615,13 @@ class ForceField(object):
         (polar hydrogen, donor-accpetor pair) that aren't. Revisit later.
         DOI:10.1002/(SICI)1096-987X(199604)17:5/6<520::AID-JCC2>3.0.CO;2-W
         """
-        try:
-            r1 = (self.at_dict[label[0]].sep_fact
-                 *self.at_dict[label[0]].polar)
-        except KeyError:
-            r1 = (self.at_dict['Fe'].sep_fact
-                 *self.at_dict['Fe'].polar)
+        at1 = self._params_MMFF94(label[0])
+        r1 = at1.sep_fact*at1.polar
         if label[0] == label[1]:
             return r1
 
-        try:
-            r2 = (self.at_dict[label[1]].sep_fact
-                 *self.at_dict[label[1]].polar)
-        except KeyError:
-            r2 = (self.at_dict['Fe'].sep_fact
-                 *self.at_dict['Fe'].polar)
+        at2 = self._params_MMFF94(label[1])
+        r2 = at2.sep_fact*at2.polar
 
         b = .2; beta = 12
         gam12 = (r1 - r2)/(r1 + r2)
@@ -627,29 +640,11 @@ class ForceField(object):
         hydrogen, donor-accpetor pair) that aren't. Revisit later.
         DOI:10.1002/(SICI)1096-987X(199604)17:5/6<520::AID-JCC2>3.0.CO;2-W
         """
-        try:
-            g1 = self.at_dict[label[0]].dep_fact
-            p1 = self.at_dict[label[0]].polar
-            n1 = self.at_dict[label[0]].eff_ele
-        except KeyError:
-            # Every element not defined in some way defaults to 
-            # iron because they would likely be larger elements
-            g1 = self.at_dict['Fe'].dep_fact
-            p1 = self.at_dict['Fe'].polar
-            n1 = self.at_dict['Fe'].eff_ele
+        at1 = self._params_MMFF94(label[0])
+        g1, p1, n1 = at1.dep_fact, at1.polar, at1.eff_ele
 
-
-        try:
-            g2 = self.at_dict[label[1]].dep_fact
-            p2 = self.at_dict[label[1]].polar
-            n2 = self.at_dict[label[1]].eff_ele
-        except KeyError:
-            # Every element not defined in some way defaults to 
-            # iron because they would likely be larger elements
-            g2 = self.at_dict['Fe'].dep_fact
-            p2 = self.at_dict['Fe'].polar
-            n2 = self.at_dict['Fe'].eff_ele
-            pass
+        at2 = self._params_MMFF94(label[1])
+        g2, p2, n2 = at2.dep_fact, at2.polar, at2.eff_ele
     
         depth = (181.16*g1*g2*p1*p2
               / (math.sqrt(p1/n1) + math.sqrt(p2/n2)